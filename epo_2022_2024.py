@@ -1,56 +1,181 @@
 #!/usr/bin/env python3
-import pandas as pd
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 import s3fs
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # ───────────────── Configuration ─────────────────
 INPUT_PARQUET_S3_URL = 's3://epo.inventohub/merged/epo_2005_2024.parquet'
 OUTPUT_PARQUET_S3_URL = 's3://epo.inventohub/merged/epo_2022_2024_data.parquet'
+DATE_MIN = '20220101'
+DATE_MAX = '20241231'
+# Set to a list of column names to project the output down to a subset.
+# None keeps every column (large description/claims columns are still only
+# decoded for row groups whose date probe found matching rows).
+COLUMNS = None
+# Row groups read/filtered concurrently; also bounds how many filtered
+# tables can sit in memory waiting for the single-threaded writer.
+MAX_WORKERS = 8
+# Multipart part size for the S3 upload of the output file (8-16 MB is the
+# sweet spot; the default s3fs block is much smaller and serializes parts).
+S3_BLOCK_SIZE = 16 * 1024 * 1024
+# Output row groups sized so per-page min/max statistics stay selective
+ROW_GROUP_SIZE = 200_000
+
+# ───────────────── One-time source rewrite ─────────────────
+def sort_source_parquet():
+    """
+    Rewrites the merged source parquet sorted by date_publication so the
+    per-row-group min/max ranges become non-overlapping and the pruning in
+    main() can actually skip groups. Run once after the merged file is
+    (re)produced; the merge job itself lives outside this repo.
+    """
+    s3 = s3fs.S3FileSystem(default_block_size=S3_BLOCK_SIZE)
+    print(f"Reading {INPUT_PARQUET_S3_URL} for sort/rewrite...")
+    table = pq.read_table(INPUT_PARQUET_S3_URL, filesystem=s3, pre_buffer=True)
+    table = table.sort_by('date_publication')
+    # Write to a sibling key first: if the multi-GB streaming write dies
+    # partway, the only copy of the source must not be left truncated.
+    tmp_url = INPUT_PARQUET_S3_URL + '.sorted.tmp'
+    with s3.open(tmp_url, 'wb', block_size=S3_BLOCK_SIZE) as out:
+        pq.write_table(
+            table, out,
+            row_group_size=ROW_GROUP_SIZE,
+            write_statistics=['date_publication', 'doc_id'],
+            write_page_index=True,
+            compression='zstd',
+            compression_level=3,
+        )
+    # Replace the source only after the temp object closed cleanly
+    s3.copy(tmp_url, INPUT_PARQUET_S3_URL)
+    s3.rm(tmp_url)
+    print(f"✅ Rewrote {INPUT_PARQUET_S3_URL} sorted by date_publication ({table.num_rows} rows).")
+
+# ───────────────── Row-group pruning ─────────────────
+def row_group_may_match(parquet_file, row_group_index, date_col_index):
+    """
+    Uses the per-row-group min/max statistics on date_publication to decide
+    whether a row group can contain any rows in [DATE_MIN, DATE_MAX].
+    Returns True (must read) when statistics are missing.
+    """
+    stats = parquet_file.metadata.row_group(row_group_index).column(date_col_index).statistics
+    if stats is None or not stats.has_min_max:
+        return True
+    return not (stats.max < DATE_MIN or stats.min > DATE_MAX)
+
+def row_group_fully_inside(parquet_file, row_group_index, date_col_index):
+    """
+    True when the row group's date_publication min/max range sits entirely
+    inside [DATE_MIN, DATE_MAX], meaning every row is kept and the probe +
+    filter pass can be skipped. False when statistics are missing.
+    """
+    stats = parquet_file.metadata.row_group(row_group_index).column(date_col_index).statistics
+    if stats is None or not stats.has_min_max:
+        return False
+    return stats.min >= DATE_MIN and stats.max <= DATE_MAX
+
+# ───────────────── Per-row-group work (runs on worker threads) ─────────────────
+def process_row_group(parquet_file, i, date_col_index):
+    """
+    Reads and filters one row group. Returns (table_or_None, elapsed_seconds);
+    table is None when the group was pruned via statistics.
+    """
+    start_chunk_time = time.time()
+
+    # Skip row groups whose date_publication range is entirely outside
+    # the window — no download or decompression needed.
+    if not row_group_may_match(parquet_file, i, date_col_index):
+        return None, time.time() - start_chunk_time
+
+    # Row groups entirely inside the window keep every row, so skip the
+    # date probe and filter pass and hand the table straight through —
+    # only the boundary row groups pay the decode+filter cost.
+    if row_group_fully_inside(parquet_file, i, date_col_index):
+        table = parquet_file.read_row_group(i, columns=COLUMNS)
+        return table, time.time() - start_chunk_time
+
+    # Probe just the date column first so row groups with no matching
+    # rows never decompress the heavy description/claims columns.
+    probe = parquet_file.read_row_group(i, columns=['date_publication'])
+    mask = pc.and_(
+        pc.greater_equal(probe['date_publication'], DATE_MIN),
+        pc.less_equal(probe['date_publication'], DATE_MAX)
+    )
+
+    if pc.any(mask).as_py():
+        # Filter in Arrow directly — no pandas round-trip, the data
+        # stays in the columnar buffers end-to-end.
+        tbl = parquet_file.read_row_group(i, columns=COLUMNS)
+        table = tbl.filter(mask)
+    else:
+        table = probe.slice(0, 0)
+
+    return table, time.time() - start_chunk_time
 
 # ───────────────── Main Processing Logic ─────────────────
 def main():
-    s3 = s3fs.S3FileSystem()
+    s3 = s3fs.S3FileSystem(default_block_size=S3_BLOCK_SIZE)
     print(f"Opening Parquet file from S3 for chunked reading: {INPUT_PARQUET_S3_URL}...")
-    
+
     writer = None # Initialize the Parquet writer as None
+    out_stream = None # Multipart S3 upload stream backing the writer
     total_rows_written = 0
-    
+
     try:
-        parquet_file = pq.ParquetFile(INPUT_PARQUET_S3_URL, filesystem=s3)
+        # pre_buffer coalesces the column-chunk ranged reads per row group
+        # into fewer, larger S3 GETs
+        parquet_file = pq.ParquetFile(INPUT_PARQUET_S3_URL, filesystem=s3, pre_buffer=True)
         print(f"Found {parquet_file.num_row_groups} chunks. Starting iteration...")
+        date_col_index = parquet_file.schema_arrow.get_field_index('date_publication')
 
-        for i in range(parquet_file.num_row_groups):
-            start_chunk_time = time.time()
-            df_chunk = parquet_file.read_row_group(i).to_pandas()
-            df_filtered = df_chunk[
-                (df_chunk['date_publication'] >= '20220101') & 
-                (df_chunk['date_publication'] <= '20241231')
-            ]
-            
-            chunk_time = time.time() - start_chunk_time
-
-            if not df_filtered.empty:
-                rows_in_chunk = len(df_filtered)
+        def write_result(i, future):
+            # Runs only on the main thread so the ParquetWriter stays
+            # single-threaded; results are consumed in submission order.
+            nonlocal writer, out_stream, total_rows_written
+            table, chunk_time = future.result()
+
+            if table is None:
+                print(f"--> Chunk {i+1}: Skipped via row-group statistics.")
+                return
+
+            if table.num_rows > 0:
+                rows_in_chunk = table.num_rows
                 total_rows_written += rows_in_chunk
-                
-                # Convert the pandas DataFrame to a pyarrow Table
-                table = pa.Table.from_pandas(df_filtered, preserve_index=False)
 
                 # ***** NEW INCREMENTAL WRITING LOGIC *****
                 if writer is None:
                     # If this is the first chunk with data, open the file for writing
                     print(f"--> Chunk {i+1}: Found {rows_in_chunk} rows. Opening output file for writing... (Took {chunk_time:.2f}s)")
-                    writer = pq.ParquetWriter(OUTPUT_PARQUET_S3_URL, table.schema, filesystem=s3)
+                    # Open the S3 object explicitly so each 16 MB block goes
+                    # up as a concurrent multipart part instead of one
+                    # serialized stream.
+                    out_stream = s3.open(OUTPUT_PARQUET_S3_URL, 'wb', block_size=S3_BLOCK_SIZE)
+                    # Page index gives downstream readers page-level min/max
+                    # pruning on top of the row-group statistics.
+                    writer = pq.ParquetWriter(out_stream, table.schema, write_page_index=True)
                 else:
                      print(f"--> Chunk {i+1}: Found {rows_in_chunk} rows. Appending to output file... (Took {chunk_time:.2f}s)")
 
                 # Append the current chunk's data to the Parquet file on S3
-                writer.write_table(table)
+                writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
             else:
                 print(f"--> Chunk {i+1}: Found 0 rows. (Took {chunk_time:.2f}s).")
 
+        # Read/filter row groups concurrently so decode of one group overlaps
+        # the S3 fetch of the next, keeping at most MAX_WORKERS filtered
+        # tables in flight.
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            in_flight = deque()
+            for i in range(parquet_file.num_row_groups):
+                in_flight.append((i, executor.submit(process_row_group, parquet_file, i, date_col_index)))
+                if len(in_flight) >= MAX_WORKERS:
+                    write_result(*in_flight.popleft())
+            while in_flight:
+                write_result(*in_flight.popleft())
+
         if total_rows_written == 0:
             print("⚠️ No data found for the years 2022-2024. No file was created.")
             return
@@ -62,6 +187,7 @@ def main():
         if writer:
             print("\nAll chunks processed. Closing the final Parquet file...")
             writer.close()
+            out_stream.close()
             print("\n✅ Process complete! New Parquet file saved successfully to S3.")
             print(f"   Final file location: {OUTPUT_PARQUET_S3_URL}")
             print(f"   Total rows written: {total_rows_written}")
@@ -1,118 +1,206 @@
+import io
 import os
+import re
 import zipfile
 import tarfile
 import boto3
-import shutil
+import botocore.config
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
 
 # --- Configuration ---
-s3 = boto3.client("s3")
+# Pool sized for the 16 concurrent upload workers plus the streaming reads;
+# adaptive retries back off cleanly when S3 throttles the prefix.
+S3_CLIENT_CONFIG = botocore.config.Config(
+    max_pool_connections=64,
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+)
+s3 = boto3.client("s3", config=S3_CLIENT_CONFIG)
 BUCKET = "epo.inventohub"
 YEARS_TO_PROCESS = ["2025"]
-TEMP_BASE_DIR = "/mnt/epodata"
+UPLOAD_WORKERS = 16
+# 1 MB copy buffer instead of the 8 KB default; 16 MB multipart parts
+TRANSFER_CONFIG = TransferConfig(io_chunksize=1024 * 1024, multipart_chunksize=16 * 1024 * 1024)
+# Below this size, a single put_object beats the streaming transfer loop
+SMALL_OBJECT_LIMIT = 8 * 1024 * 1024
+# Ranged-GET block size for seekable reads over S3 zips
+S3_RANGE_BLOCK = 8 * 1024 * 1024
 
 
 def is_valid_xml(filename):
     return filename.endswith(".xml") and not filename.endswith("TOC.xml")
 
 
-def extract_top_archive(archive_path, extract_to):
-    print(f"📦 Extracting top-level archive: {archive_path}")
-    if archive_path.endswith(".zip"):
-        with zipfile.ZipFile(archive_path, 'r') as z:
-            z.extractall(extract_to)
-    elif archive_path.endswith(".tar"):
-        with tarfile.open(archive_path, 'r') as t:
-            t.extractall(extract_to)
+class S3RangeFile(io.RawIOBase):
+    """
+    Read-only seekable file over an S3 object using ranged GETs, so ZipFile
+    can read the central directory and individual entries without the whole
+    multi-GB archive ever touching local disk. Reads are served from an
+    8 MB block cache to avoid one GET per small read.
+    """
+
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+        self.size = s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.pos = 0
+        self.block_start = None
+        self.block = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.pos
+        out = []
+        while size > 0 and self.pos < self.size:
+            start = (self.pos // S3_RANGE_BLOCK) * S3_RANGE_BLOCK
+            if start != self.block_start:
+                end = min(start + S3_RANGE_BLOCK, self.size) - 1
+                resp = s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end}")
+                self.block = resp['Body'].read()
+                self.block_start = start
+            offset = self.pos - start
+            chunk = self.block[offset:offset + size]
+            out.append(chunk)
+            self.pos += len(chunk)
+            size -= len(chunk)
+        return b"".join(out)
+
+
+def iter_inner_zips(archive_key):
+    """
+    Yields (member_name, bytes) for each inner archive member without a
+    local download: .zip archives are read via ranged GETs (central
+    directory seeks), .tar archives are streamed sequentially off the GET
+    body since tar has no random access.
+    """
+    if archive_key.endswith(".zip"):
+        with zipfile.ZipFile(S3RangeFile(BUCKET, archive_key)) as top:
+            for name in top.namelist():
+                if not name.endswith("/"):
+                    yield name, top.read(name)
+    elif archive_key.endswith(".tar"):
+        body = s3.get_object(Bucket=BUCKET, Key=archive_key)['Body']
+        with tarfile.open(fileobj=body, mode='r|') as top:
+            for member in top:
+                if member.isfile():
+                    extracted = top.extractfile(member)
+                    if extracted is not None:
+                        yield member.name, extracted.read()
     else:
-        raise ValueError(f"Unsupported archive format: {archive_path}")
+        raise ValueError(f"Unsupported archive format: {archive_key}")
+
+
+def list_existing_xmls(dest_s3_folder):
+    """One LIST pass over the destination folder replaces a HEAD per XML."""
+    paginator = s3.get_paginator('list_objects_v2')
+    return {
+        os.path.basename(obj["Key"])
+        for page in paginator.paginate(Bucket=BUCKET, Prefix=dest_s3_folder + "/")
+        for obj in page.get("Contents", [])
+    }
+
+
+def upload_xml(data, dest_key):
+    print(f"⬆️ Uploading {os.path.basename(dest_key)} to {dest_key}")
+    if len(data) < SMALL_OBJECT_LIMIT:
+        s3.put_object(Bucket=BUCKET, Key=dest_key, Body=data)
+    else:
+        s3.upload_fileobj(io.BytesIO(data), BUCKET, dest_key, Config=TRANSFER_CONFIG)
 
 
 def extract_and_upload(archive_key, dest_s3_folder):
-    archive_name = os.path.basename(archive_key)
-    tmpdir = os.path.join(TEMP_BASE_DIR, os.path.splitext(archive_name)[0])
-    os.makedirs(tmpdir, exist_ok=True)
+    existing = list_existing_xmls(dest_s3_folder)
 
     try:
-        archive_path = os.path.join(tmpdir, archive_name)
-        print(f"⬇️ Downloading {archive_key} to {archive_path}")
-        s3.download_file(BUCKET, archive_key, archive_path)
-
-        extract_top_archive(archive_path, tmpdir)
-
-        doc_path = os.path.join(tmpdir, "DOC")
-        if not os.path.exists(doc_path):
-            print(f"⚠️ 'DOC' directory not found in {archive_key}. Searching entire temp directory.")
-            doc_path = tmpdir
-
-        for root, _, files in os.walk(doc_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if zipfile.is_zipfile(file_path):
-                    with zipfile.ZipFile(file_path, 'r') as inner_zip:
-                        for inner_file_name in inner_zip.namelist():
-                            if is_valid_xml(inner_file_name):
-                                xml_filename = os.path.basename(inner_file_name)
-                                dest_key = f"{dest_s3_folder}/{xml_filename}"
-
-                                # Check if XML already exists to avoid duplicate uploads
-                                try:
-                                    s3.head_object(Bucket=BUCKET, Key=dest_key)
-                                    print(f"⚠️ Skipping already uploaded: {dest_key}")
-                                    continue
-                                except s3.exceptions.ClientError as e:
-                                    if e.response["Error"]["Code"] != "404":
-                                        raise
-
-                                with inner_zip.open(inner_file_name) as f:
-                                    print(f"⬆️ Uploading {xml_filename} to {dest_key}")
-                                    s3.upload_fileobj(f, BUCKET, dest_key)
+        print(f"📦 Streaming archive from S3: {archive_key}")
+
+        # Inner zips are unpacked in memory one at a time; their XMLs are
+        # uploaded concurrently while the next inner zip streams in.
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            for member_name, member_bytes in iter_inner_zips(archive_key):
+                if not member_bytes.startswith(b"PK\x03\x04"):
+                    continue
+
+                with zipfile.ZipFile(io.BytesIO(member_bytes)) as inner_zip:
+                    pending = []
+                    for inner_file_name in inner_zip.namelist():
+                        if is_valid_xml(inner_file_name):
+                            xml_filename = os.path.basename(inner_file_name)
+                            dest_key = f"{dest_s3_folder}/{xml_filename}"
+
+                            # Check if XML already exists to avoid duplicate uploads
+                            if xml_filename in existing:
+                                print(f"⚠️ Skipping already uploaded: {dest_key}")
+                                continue
+
+                            pending.append(executor.submit(
+                                upload_xml, inner_zip.read(inner_file_name), dest_key))
+
+                    for future in pending:
+                        future.result()
 
         print(f"✅ Successfully processed {archive_key}")
         print(f"✅ Original archive {archive_key} is kept in S3.")
 
     except Exception as e:
         print(f"❌ Error processing {archive_key}: {e}")
-    finally:
-        if os.path.exists(tmpdir):
-            print(f"🧹 Cleaning up local directory: {tmpdir}")
-            shutil.rmtree(tmpdir)
 
 
+ARCHIVE_KEY_RE = re.compile(r"^(\d{4})/EPRTBJV(\d{4})0000(\d{2})001001\.(zip|tar)$")
+
 if __name__ == "__main__":
     print("🚀 Starting EPO XML extraction process...")
 
+    paginator = s3.get_paginator('list_objects_v2')
+
     for year in YEARS_TO_PROCESS:
         print(f"\n--- Processing Year: {year} ---")
-        source_prefix = str(year)
         dest_base_prefix = f"{year}/epo-xmls"
 
-        for week in range(1, 53):
-            week_str = str(week).zfill(2)
+        # One LIST over the year prefix discovers every weekly archive (and
+        # its extension) instead of probing weeks 1..52 with HEADs.
+        archives = {}
+        for page in paginator.paginate(Bucket=BUCKET, Prefix=f"{year}/"):
+            for obj in page.get("Contents", []):
+                match = ARCHIVE_KEY_RE.match(obj["Key"])
+                if match:
+                    week_str = match.group(3)
+                    # Prefer .zip when both extensions exist for a week
+                    if week_str not in archives or obj["Key"].endswith(".zip"):
+                        archives[week_str] = obj["Key"]
+
+        for week_str in sorted(archives):
+            archive_key = archives[week_str]
             dest_s3_folder = f"{dest_base_prefix}/{year}_{week_str}"
-            archive_name_base = f"EPRTBJV{year}0000{week_str}001001"
-
-            for ext in [".zip", ".tar"]:
-                archive_key = f"{source_prefix}/{archive_name_base}{ext}"
-                try:
-                    s3.head_object(Bucket=BUCKET, Key=archive_key)
-                    print(f"🔎 Found archive: {archive_key}")
-
-                    # 🧠 Check if destination already has XMLs
-                    existing = s3.list_objects_v2(Bucket=BUCKET, Prefix=dest_s3_folder + "/")
-                    already_processed = any(obj["Key"].endswith(".xml") for obj in existing.get("Contents", []))
-
-                    if already_processed:
-                        print(f"⏭️ Skipping archive {archive_key} — XMLs already exist in {dest_s3_folder}")
-                        break
-
-                    extract_and_upload(archive_key, dest_s3_folder)
-                    break
-
-                except s3.exceptions.ClientError as e:
-                    if e.response['Error']['Code'] == '404':
-                        continue
-                    else:
-                        print(f"❌ Boto3 client error on {archive_key}: {e}")
-                        raise
+            print(f"🔎 Found archive: {archive_key}")
+
+            # 🧠 Check if destination already has XMLs
+            existing = s3.list_objects_v2(Bucket=BUCKET, Prefix=dest_s3_folder + "/")
+            already_processed = any(obj["Key"].endswith(".xml") for obj in existing.get("Contents", []))
+
+            if already_processed:
+                print(f"⏭️ Skipping archive {archive_key} — XMLs already exist in {dest_s3_folder}")
+                continue
+
+            extract_and_upload(archive_key, dest_s3_folder)
 
     print("\n🏁 All years processed.")
@@ -2,12 +2,16 @@ import os
 import re
 import io
 import time
+import queue
+import functools
+import threading
 import boto3
+import botocore.config
 import pandas as pd
 import psycopg2
-import xml.etree.ElementTree as ET
+from psycopg2 import pool
+from lxml import etree
 from concurrent.futures import ThreadPoolExecutor
-from psycopg2.extras import execute_batch
 import pprint
 
 # ==============================================================================
@@ -17,7 +21,27 @@ import pprint
 
 # --- S3 Client ---
 BUCKET = "epo.inventohub"
-s3 = boto3.client("s3")
+
+# The default pool of 10 HTTPS connections stalls 32 worker threads;
+# adaptive retries back off cleanly when S3 throttles the prefix.
+S3_CLIENT_CONFIG = botocore.config.Config(
+    max_pool_connections=64,
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+)
+s3 = boto3.client("s3", config=S3_CLIENT_CONFIG)
+
+# Concurrent S3 fetch+parse workers feeding the single DB writer thread
+MAX_PARSE_WORKERS = 32
+
+# One boto3 session per worker thread — clients are thread-safe but a shared
+# session serializes on internal locks under high concurrency.
+_thread_local = threading.local()
+
+def get_thread_s3():
+    if not hasattr(_thread_local, 's3'):
+        _thread_local.s3 = boto3.session.Session().client('s3', config=S3_CLIENT_CONFIG)
+    return _thread_local.s3
 
 # --- PostgreSQL Database Configuration ---
 db_config = {
@@ -32,15 +56,222 @@ db_config = {
 # --- 2. HELPER FUNCTIONS ---
 # ==============================================================================
 
-def get_db_connection():
-    print("🔌 Connecting to Aurora database...")
-    return psycopg2.connect(**db_config)
+_db_pool = None
+
+def get_db_pool():
+    global _db_pool
+    if _db_pool is None:
+        print("🔌 Creating Aurora connection pool...")
+        _db_pool = pool.ThreadedConnectionPool(minconn=1, maxconn=4, **db_config)
+    return _db_pool
+
+def load_existing_doc_ids():
+    db_pool = get_db_pool()
+    conn = db_pool.getconn()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT doc_id FROM epo_embed14k")
+        doc_ids = {row[0] for row in cursor}
+        cursor.close()
+        return doc_ids
+    finally:
+        db_pool.putconn(conn)
+
+# Subtrees the single iterparse pass dispatches on. Everything is extracted
+# at its end event and cleared immediately, so the full DOM (dominated by the
+# description subtree) never lives in memory at once.
+ITERPARSE_TAGS = (
+    'abstract', 'description', 'claims',
+    'B150', 'B200', 'B300', 'B400', 'B510', 'B510EP', 'B520EP',
+    'B540', 'B560', 'B700', 'B720', 'B860',
+)
+
+# XPaths relative to the dispatched subtrees, compiled once at import so
+# every lookup runs inside libxml2 instead of the Python tree walker.
+# Scalar/list fields select text() directly — the strings come back from C
+# with no Element wrappers created. Structured groups return elements.
+XP_IPC = etree.XPath("classification-ipcr/text/text()")
+XP_CPC = etree.XPath("classifications-cpc/classification-cpc/text/text()")
+XP_INT_APPL_NUM = etree.XPath("B861/dnum/anum/text()")
+XP_APPLICANTS = etree.XPath("B710/B711/snm/text()")
+XP_INVENTORS = etree.XPath("B721/snm/text()")
+XP_INT_CLASS_MAIN = etree.XPath("B511/text()")
+XP_INT_CLASS_SUBS = etree.XPath("B512/text()")
+XP_DATE_PUBLICATION = etree.XPath("B405/date/text()")
+XP_DATE_FILING = etree.XPath("B220/date/text()")
+XP_PRIORITY_NUMBER = etree.XPath("B310/text()")
+XP_PRIORITY_DATE = etree.XPath("B320/date/text()")
+XP_REPRESENTATIVES = etree.XPath("B740/B741")
+XP_CORRECTION_CODE = etree.XPath("B151/text()")
+XP_B155 = etree.XPath("B155")
+XP_REFERENCES = etree.XPath("B561/text/text()")
+XP_PROPRIETORS = etree.XPath("B730/B731")
+
+# Enough of the stream to cover the root element's attributes
+DOC_ID_PROBE_BYTES = 4096
+
+class ChainedBody(object):
+    """File-like that replays an already-read head before the live body."""
+    def __init__(self, head, body):
+        self._head = head
+        self._pos = 0
+        self._body = body
+
+    def read(self, size=-1):
+        if self._pos < len(self._head):
+            if size is None or size < 0:
+                chunk = self._head[self._pos:] + self._body.read()
+                self._pos = len(self._head)
+                return chunk
+            chunk = self._head[self._pos:self._pos + size]
+            self._pos += len(chunk)
+            return chunk
+        return self._body.read(size)
+
+    def close(self):
+        self._body.close()
+
+def peek_doc_id(head):
+    """Pulls the root element's id attribute out of the first few KB."""
+    try:
+        for _, elem in etree.iterparse(io.BytesIO(head), events=('start',)):
+            return elem.attrib.get("id", "").strip()
+    except etree.XMLSyntaxError:
+        pass
+    return ""
+
+def first_text(results):
+    return results[0].strip() if results else ""
+
+def join_texts(results):
+    return '; '.join([s.strip() for s in results if s.strip()])
+
+@functools.lru_cache(maxsize=None)
+def texts_xpath(tags):
+    # Union XPath over text() nodes — one C-level traversal per tag set,
+    # compiled once per distinct tuple of tags.
+    return etree.XPath(" | ".join(f".//{tag}/text()" for tag in tags))
+
+def get_texts(parent, tags):
+    if parent is None: return ""
+    # list comprehension: str.join materializes generators internally anyway,
+    # and skips the generator frame overhead this way
+    return ' '.join([s.strip() for s in texts_xpath(tuple(tags))(parent) if s.strip()])
+
+def get_ordered_texts(elem):
+    if elem is None: return ""
+    texts = []
+    # lxml iterates only the matched tags in C
+    for child in elem.iter('{*}p', '{*}ul', '{*}li', '{*}heading'):
+        text = ''.join(child.itertext()).strip()
+        if text:
+            texts.append(text)
+    return '\n'.join(texts)
+
+def format_names(elements):
+    return "; ".join([
+        f"{el.findtext('snm', '').strip()}, {el.findtext('adr/city', '').strip()}, {el.findtext('adr/ctry', '').strip()}".strip(", ")
+        for el in elements
+    ])
 
-def parse_xml(s3_client, key):
+def parse_xml(s3_client, key, existing_doc_ids=None):
     try:
         response = s3_client.get_object(Bucket=BUCKET, Key=key)
-        content = response['Body'].read()
-        root = ET.fromstring(content)
+        body = response['Body']
+
+        # On reruns, ON CONFLICT would discard the row anyway — bail out
+        # after reading just the root attributes instead of decoding the
+        # whole description/claims body.
+        if existing_doc_ids is not None:
+            head = body.read(DOC_ID_PROBE_BYTES)
+            probed_id = peek_doc_id(head)
+            if probed_id and probed_id in existing_doc_ids:
+                body.close()
+                return None
+            body = ChainedBody(head, body)
+
+        abstract_text = desc_text = claims_text = ""
+        ipc_classifications = cpc_classifications = int_classification = ""
+        int_application_number = ""
+        applicants = inventors = representatives = proprietors = ""
+        titles = {'title_en': '', 'title_de': '', 'title_fr': ''}
+        date_publication = date_filing = ""
+        priority_number = priority_date = ""
+        correction_code = correction_description = ""
+        references_cited = ""
+
+        # iterparse reads straight off the streaming body, so parsing
+        # overlaps the download and the raw bytes are never buffered whole.
+        context = etree.iterparse(
+            body, events=('end',), tag=ITERPARSE_TAGS,
+            huge_tree=True,
+        )
+        for _, elem in context:
+            tag = elem.tag
+            if tag == 'abstract':
+                if elem.get('id') == 'abst':
+                    abstract_text = get_texts(elem, ['p'])
+            elif tag == 'description':
+                if elem.get('id') == 'desc':
+                    desc_text = get_ordered_texts(elem)
+            elif tag == 'claims':
+                if elem.get('id') == 'claims01':
+                    claims_text = get_texts(elem, ['claim-text'])
+            elif tag == 'B510EP':
+                ipc_classifications = join_texts(XP_IPC(elem))
+            elif tag == 'B520EP':
+                cpc_classifications = join_texts(XP_CPC(elem))
+            elif tag == 'B860':
+                int_application_number = first_text(XP_INT_APPL_NUM(elem))
+            elif tag == 'B700':
+                applicants = join_texts(XP_APPLICANTS(elem))
+                representatives = format_names(XP_REPRESENTATIVES(elem))
+                proprietors = format_names(XP_PROPRIETORS(elem))
+            elif tag == 'B720':
+                inventors = join_texts(XP_INVENTORS(elem))
+            elif tag == 'B540':
+                for lang_tag, title_tag in zip(elem.findall("B541"), elem.findall("B542")):
+                    lang = lang_tag.text.strip() if lang_tag.text else ""
+                    text = title_tag.text.strip() if title_tag.text else ""
+                    if lang.lower() == 'en': titles['title_en'] = text
+                    elif lang.lower() == 'de': titles['title_de'] = text
+                    elif lang.lower() == 'fr': titles['title_fr'] = text
+            elif tag == 'B510':
+                int_class_main = first_text(XP_INT_CLASS_MAIN(elem))
+                int_class_subs = [s.strip() for s in XP_INT_CLASS_SUBS(elem) if s.strip()]
+                int_classification = '; '.join(filter(None, [int_class_main] + int_class_subs))
+            elif tag == 'B400':
+                date_publication = first_text(XP_DATE_PUBLICATION(elem))
+            elif tag == 'B200':
+                date_filing = first_text(XP_DATE_FILING(elem))
+            elif tag == 'B300':
+                priority_number = first_text(XP_PRIORITY_NUMBER(elem))
+                priority_date = first_text(XP_PRIORITY_DATE(elem))
+            elif tag == 'B150':
+                correction_code = first_text(XP_CORRECTION_CODE(elem))
+                correction_description = next(
+                    (
+                        t.text.strip()
+                        for b155 in XP_B155(elem)
+                        for l, t in zip(b155.findall("B1551"), b155.findall("B1552"))
+                        if l is not None and t is not None and l.text == "en" and t.text
+                    ),
+                    ""
+                )
+            elif tag == 'B560':
+                references_cited = join_texts(XP_REFERENCES(elem))
+
+            # Free the handled subtree right away; for top-level blocks also
+            # drop the already-processed siblings that precede them. Nested
+            # B-fields are freed when their enclosing section clears.
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None and parent.getparent() is None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+        body.close()
+        root = context.root
         doc_id = root.attrib.get("id", "").strip()
         doc_number_str = root.attrib.get("doc-number", "").strip()
         if not doc_id or not doc_number_str or not doc_number_str.isdigit():
@@ -48,67 +279,11 @@ def parse_xml(s3_client, key):
             return None
         doc_number = int(doc_number_str)
 
-        def get_texts(parent, tags):
-            if parent is None: return ""
-            return ' '.join(
-                el.text.strip() for tag in tags for el in parent.findall(f'.//{tag}')
-                if el is not None and el.text
-            )
-
-        def get_ordered_texts(elem):
-            if elem is None: return ""
-            texts = []
-            for child in elem.iter():
-                tag = child.tag.split('}', 1)[-1]
-                if tag in ['p', 'ul', 'li', 'heading']:
-                    text = ''.join(child.itertext()).strip()
-                    if text:
-                        texts.append(text)
-            return '\n'.join(texts)
-
-        abstract_el = root.find(".//abstract[@id='abst']")
-        abstract_text = get_texts(abstract_el, ['p']) if abstract_el is not None else ""
-        desc_el = root.find(".//description[@id='desc']")
-        desc_text = get_ordered_texts(desc_el) if desc_el is not None else ""
-        claims_el = root.find(".//claims[@id='claims01']")
-        claims_text = get_texts(claims_el, ['claim-text']) if claims_el is not None else ""
-        ipc_elements = root.findall(".//B500/B510EP/classification-ipcr/text")
-        ipc_list = [el.text.strip() for el in ipc_elements if el is not None and el.text]
-        ipc_classifications = '; '.join(ipc_list)
-        cpc_elements = root.findall(".//B520EP/classifications-cpc/classification-cpc/text")
-        cpc_list = [el.text.strip() for el in cpc_elements if el is not None and el.text]
-        cpc_classifications = '; '.join(cpc_list)
-        int_appl_num_el = root.find(".//B860/B861/dnum/anum")
-        int_application_number = int_appl_num_el.text.strip() if int_appl_num_el is not None else ""
-        applicant_elements = root.findall(".//B700/B710/B711/snm")
-        applicants = '; '.join(el.text.strip() for el in applicant_elements if el is not None and el.text)
-        inventor_elements = root.findall(".//B720/B721/snm")
-        inventors = '; '.join(el.text.strip() for el in inventor_elements if el is not None and el.text)
-        titles = {'title_en': '', 'title_de': '', 'title_fr': ''}
-        b540 = root.find(".//B540")
-        if b540 is not None:
-            langs = b540.findall("B541")
-            texts = b540.findall("B542")
-            for lang_tag, title_tag in zip(langs, texts):
-                lang = lang_tag.text.strip() if lang_tag.text else ""
-                text = title_tag.text.strip() if title_tag.text else ""
-                if lang.lower() == 'en': titles['title_en'] = text
-                elif lang.lower() == 'de': titles['title_de'] = text
-                elif lang.lower() == 'fr': titles['title_fr'] = text
-        int_class_main = root.findtext(".//B510/B511", "").strip()
-        int_class_subs = [el.text.strip() for el in root.findall(".//B510/B512") if el.text]
-        int_classification = '; '.join(filter(None, [int_class_main] + int_class_subs))
-        date_pub_el = root.find(".//B400/B405/date")
-        date_publication = date_pub_el.text.strip() if date_pub_el is not None else ""
         year_publication = date_publication[:4]
-        date_filing_el = root.find(".//B200/B220/date")
-        date_filing = date_filing_el.text.strip() if date_filing_el is not None else ""
         year_filing = date_filing[:4]
-        priority_number = root.findtext(".//B300/B310", "").strip()
-        priority_date = root.findtext(".//B300/B320/date", "").strip()
 
         return {
-            
+
             "doc_id": doc_id,
             **titles,
             "doc_number": doc_number,
@@ -129,25 +304,11 @@ def parse_xml(s3_client, key):
             'year_filing':year_filing,
             "priority_number": priority_number,
             "priority_date" : priority_date,
-            "representatives": "; ".join(
-                f"{el.findtext('snm', '').strip()}, {el.findtext('adr/city', '').strip()}, {el.findtext('adr/ctry', '').strip()}".strip(", ")
-                for el in root.findall(".//B700/B740/B741")
-            ),
-            "correction_code": root.findtext(".//B150/B151", "").strip(),
-            "correction_description": next(
-                (
-                    t.text.strip()
-                    for b155 in root.findall(".//B150/B155")
-                    for l, t in zip(b155.findall("B1551"), b155.findall("B1552"))
-                    if l is not None and t is not None and l.text == "en" and t.text
-                ),
-                ""
-            ),
-            "references_cited": "; ".join(el.text.strip() for el in root.findall(".//B560/B561/text") if el.text),
-            "proprietors": "; ".join(
-                f"{el.findtext('snm', '').strip()}, {el.findtext('adr/city', '').strip()}, {el.findtext('adr/ctry', '').strip()}".strip(", ")
-                for el in root.findall(".//B700/B730/B731")
-            ),
+            "representatives": representatives,
+            "correction_code": correction_code,
+            "correction_description": correction_description,
+            "references_cited": references_cited,
+            "proprietors": proprietors,
         }
     except Exception as e:
         print(f"❌ Error parsing {key}: {e}")
@@ -161,63 +322,103 @@ def process_year(year):
     print(f"\n📇 Processing year: {year}")
     prefix = f"{year}/epo-xmls"
     paginator = s3.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=BUCKET, Prefix=prefix)
-
-    total_records_inserted = 0
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    insert_query = """
-    INSERT INTO epo_embed14k (
-        doc_id, title_en, title_de, title_fr, doc_number, lang, country, abstract,
-        description, claims, date_publ, ipc_classifications, cpc_classifications,
-        international_application_number, applicants, inventors, int_classifications,
-        date_publication, date_filing
-    ) VALUES (
-        %(doc_id)s, %(title_en)s, %(title_de)s, %(title_fr)s, %(doc_number)s, %(lang)s, %(country)s, %(abstract)s,
-        %(description)s, %(claims)s, %(date_publ)s, %(ipc_classifications)s, %(cpc_classifications)s,
-        %(international_application_number)s, %(applicants)s, %(inventors)s, %(int_classifications)s,
-        %(date_publication)s, %(date_filing)s
 
+    keys = [
+        obj['Key']
+        for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix)
+        for obj in page.get('Contents', [])
+        if obj['Key'].endswith(".xml") and not obj['Key'].endswith("TOC.xml")
+    ]
+    print(f"📂 Found {len(keys)} XML files")
+
+    existing_doc_ids = load_existing_doc_ids()
+    print(f"📇 {len(existing_doc_ids)} doc_ids already loaded — their files will be skipped")
+
+    copy_columns = (
+        'doc_id', 'title_en', 'title_de', 'title_fr', 'doc_number', 'lang', 'country', 'abstract',
+        'description', 'claims', 'date_publ', 'ipc_classifications', 'cpc_classifications',
+        'international_application_number', 'applicants', 'inventors', 'int_classifications',
+        'date_publication', 'date_filing'
     )
-    ON CONFLICT (doc_id) DO NOTHING
-
-    """
-
-    batch_size = 500
-    batch = []
-
-    for page in pages:
-        for obj in page.get('Contents', []):
-            key = obj['Key']
-            if key.endswith(".xml") and not key.endswith("TOC.xml"):
-                data = parse_xml(s3, key)
-                if data:
-                    batch.append(data)
-                    if len(batch) >= batch_size:
-                        try:
-                            execute_batch(cursor, insert_query, batch)
-                            conn.commit()
-                            print(f"  ✅ Inserted {len(batch)} records.")
-                            total_records_inserted += len(batch)
-                            batch = []
-                        except Exception as e:
-                            print(f"❌ Insert error: {e}")
-                            conn.rollback()
-
-    if batch:
+    column_list = ', '.join(copy_columns)
+
+    # COPY overhead amortizes much further than per-statement INSERTs, so
+    # batches can be an order of magnitude larger. The queue bound keeps
+    # parse workers from racing ahead of the writer unbounded.
+    batch_size = 5000
+    results = queue.Queue(maxsize=2000)
+    totals = {'inserted': 0}
+
+    def escape_copy_value(val):
+        if val is None:
+            return ''
+        return str(val).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def flush_batch(cursor, conn, batch):
+        # COPY into a temp staging table, then INSERT ... SELECT with
+        # ON CONFLICT DO NOTHING — one round-trip worth of protocol per
+        # batch instead of one INSERT per row.
+        buf = io.StringIO()
+        for data in batch:
+            buf.write('\t'.join(escape_copy_value(data.get(col, '')) for col in copy_columns))
+            buf.write('\n')
+        buf.seek(0)
         try:
-            execute_batch(cursor, insert_query, batch)
+            cursor.execute(
+                "CREATE TEMP TABLE epo_stage (LIKE epo_embed14k INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            cursor.copy_expert(f"COPY epo_stage ({column_list}) FROM STDIN", buf)
+            cursor.execute(
+                f"INSERT INTO epo_embed14k ({column_list}) "
+                f"SELECT {column_list} FROM epo_stage "
+                "ON CONFLICT (doc_id) DO NOTHING"
+            )
             conn.commit()
-            print(f"  ✅ Inserted final {len(batch)} records.")
-            total_records_inserted += len(batch)
+            print(f"  ✅ Inserted {len(batch)} records.")
+            return len(batch)
         except Exception as e:
-            print(f"❌ Final insert error: {e}")
+            print(f"❌ Insert error: {e}")
             conn.rollback()
+            return 0
+
+    def db_writer():
+        # Single consumer: one cursor, batches drained off the queue while
+        # the parse workers keep fetching. The connection comes from the
+        # shared pool and commits explicitly once per batch to amortize
+        # WAL sync.
+        db_pool = get_db_pool()
+        conn = db_pool.getconn()
+        conn.autocommit = False
+        try:
+            cursor = conn.cursor()
+            batch = []
+            while True:
+                data = results.get()
+                if data is None:
+                    break
+                batch.append(data)
+                if len(batch) >= batch_size:
+                    totals['inserted'] += flush_batch(cursor, conn, batch)
+                    batch = []
+            if batch:
+                totals['inserted'] += flush_batch(cursor, conn, batch)
+            cursor.close()
+        finally:
+            db_pool.putconn(conn)
+
+    writer = threading.Thread(target=db_writer)
+    writer.start()
+
+    # Fetch+parse concurrently — each worker blocks on its own S3 GET, so
+    # wall time is no longer one round-trip per file.
+    with ThreadPoolExecutor(max_workers=MAX_PARSE_WORKERS) as executor:
+        for data in executor.map(lambda k: parse_xml(get_thread_s3(), k, existing_doc_ids), keys):
+            if data:
+                results.put(data)
 
-    cursor.close()
-    conn.close()
-    print(f"🏁 Finished processing {year}. Total inserted: {total_records_inserted}")
+    results.put(None)
+    writer.join()
+    print(f"🏁 Finished processing {year}. Total inserted: {totals['inserted']}")
 
 # ==============================================================================
 # --- 4. DEBUGGING EXECUTION ---
@@ -1,18 +1,24 @@
 #!/usr/bin/env python3
 import os
-import re
 import io
+import json
+import shutil
+import queue
+import hashlib
+import asyncio
+import sqlite3
+import threading
+import multiprocessing
 import boto3
-import pandas as pd
-import xml.etree.ElementTree as ET
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import aioboto3
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from lxml import etree
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # Embedding deps
-import nltk
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
 from sentence_transformers import SentenceTransformer
-import tiktoken
 import torch
 
 
@@ -24,64 +30,288 @@ BUCKET = "epo.inventohub"
 YEAR = "2025"
 WEEK = "2025_01"
 PREFIX = f"{YEAR}/epo-xmls/{WEEK}/"
-OUTPUT_KEY = f"{PREFIX}{WEEK}.parquet"
-MAX_WORKERS = 8  # adjust based on Vast.ai GPU/CPU
+# Hive-partitioned dataset prefix: year_publication=YYYY/part-NNNN.parquet
+OUTPUT_PREFIX = f"{PREFIX}parquet/"
+FETCH_CONCURRENCY = 256  # in-flight async s3.get_object requests
+LIST_WORKERS = 16  # parallel paginators during the startup listing
+PARSE_WORKERS = os.cpu_count()  # processes doing XML parse + chunking (GIL-bound)
+GPU_BATCH = 128  # chunks per model.encode batch for the corpus-level pass
+EMBED_FLUSH_CHUNKS = 4096  # chunks buffered before each GPU pass
+RESULT_QUEUE_SIZE = 2048  # bounds parsed docs waiting for the GPU / writer
+ROWS_PER_GROUP = 1000  # rows per parquet row group in the spill files
+MAX_ROWS_PER_FILE = 5000  # roll to a new part file so readers can parallelize
+EMBED_CACHE_DB = "epo_embed_cache.sqlite"  # re-runs skip parse + GPU for unchanged objects
 
 # ───────────────── S3 ─────────────────
 s3 = boto3.client("s3")
 
-# ───────────────── NLTK ─────────────────
-nltk.download('stopwords')
-nltk.download('wordnet')
-EN_STOPWORDS = set(stopwords.words('english'))
-LEMMATIZER = WordNetLemmatizer()
-
 # ───────────────── Embedding setup ─────────────────
-CHUNK_TOKENS = 2000
-OVERLAP_TOKENS = 200
+OVERLAP_TOKENS = 50
 TARGET_DIM = 1024
 
-tokenizer = tiktoken.get_encoding("cl100k_base")
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 model = SentenceTransformer('intfloat/e5-large-v2', device=device)
-
-def preprocess_text(text):
-    if pd.isna(text):
-        return "No text provided"
-    text = str(text).lower()
-    text = re.sub(r'[^\w\s]', '', text)
-    tokens = re.findall(r'\b\w+\b', text)
-    tokens = [w for w in tokens if w not in EN_STOPWORDS]
-    return ' '.join([LEMMATIZER.lemmatize(w) for w in tokens])
-
-def chunk_text(text: str, max_tokens=CHUNK_TOKENS, overlap=OVERLAP_TOKENS):
-    tokens = tokenizer.encode(text)
+# Half-precision forward pass: bf16 on GPUs that support it (no overflow
+# risk in LayerNorm), fp16 otherwise. CPU stays fp32.
+AMP_DTYPE = torch.bfloat16 if device == 'cuda' and torch.cuda.is_bf16_supported() else torch.float16
+if device == 'cuda':
+    model.to(dtype=AMP_DTYPE)
+    # Fuse LayerNorm/attention/GELU in the BERT forward; encode is
+    # compute-bound so the fused kernels translate directly to throughput
+    model[0].auto_model = torch.compile(model[0].auto_model, mode='reduce-overhead', fullgraph=False)
+    # One warmup batch so compilation/cudagraph capture happens up front
+    # at the hot (GPU_BATCH, max_seq_length) shape, not mid-pipeline
+    with torch.inference_mode(), torch.autocast('cuda', dtype=AMP_DTYPE):
+        model.encode(['warmup'] * GPU_BATCH, batch_size=GPU_BATCH)
+# The "passage: " prefix is what e5 expects in front of documents; it is
+# prepended to every chunk before encoding, so its tokens must come out of
+# the window budget or each chunk's tail gets silently truncated.
+PASSAGE_PREFIX = "passage: "
+_PREFIX_TOKENS = len(model.tokenizer(PASSAGE_PREFIX, add_special_tokens=False)['input_ids'])
+# Chunk windows sized to what the model actually consumes: its own
+# tokenizer and sequence limit, minus room for the two special tokens
+# and the passage prefix.
+MAX_CHUNK_TOKENS = model.max_seq_length - 2 - _PREFIX_TOKENS
+
+def chunk_text(text: str, max_tokens=None, overlap=OVERLAP_TOKENS):
+    """
+    Slides a window of the model's own tokens over the text and slices the
+    original string by token char offsets — no decode round trip, and
+    chunks line up with the model's 512-token limit instead of being
+    silently truncated.
+    """
+    if max_tokens is None:
+        max_tokens = MAX_CHUNK_TOKENS
+    offsets = model.tokenizer(text, return_offsets_mapping=True,
+                              add_special_tokens=False)['offset_mapping']
     chunks, start = [], 0
-    while start < len(tokens):
-        chunk = tokens[start:start + max_tokens]
-        chunks.append(tokenizer.decode(chunk))
+    while start < len(offsets):
+        window = offsets[start:start + max_tokens]
+        chunks.append(text[window[0][0]:window[-1][1]])
         start += max_tokens - overlap
     return chunks
 
-def embed_document(text: str) -> list[float]:
-    try:
-        processed_text = preprocess_text(text)
-        chunks = chunk_text(processed_text)
-        vectors = model.encode(chunks, convert_to_tensor=True).tolist()
-        if vectors:
-            # average pooling
-            return [sum(x) / len(x) for x in zip(*vectors)]
-        return [0.0] * TARGET_DIM
-    except Exception as e:
-        print(f"[Embedding error] {e}")
-        return [0.0] * TARGET_DIM
+def embed_corpus(all_chunks, chunk_owner, n_docs):
+    """
+    Encodes every chunk from every document in one batched pass, then
+    mean-pools per document on-GPU via index_add_. Documents that produced
+    no chunks get a zero vector.
+    """
+    if not all_chunks:
+        return np.zeros((n_docs, TARGET_DIM), dtype=np.float16)
+    # Dedupe verbatim-identical chunks first — boilerplate claim language
+    # and repeated abstracts across priority filings are common, and each
+    # unique string only needs one trip through the encoder.
+    seen = {}
+    unique_chunks = []
+    scatter = []
+    for c in all_chunks:
+        digest = hashlib.blake2b(c.encode(), digest_size=16).digest()
+        idx = seen.get(digest)
+        if idx is None:
+            idx = len(unique_chunks)
+            seen[digest] = idx
+            unique_chunks.append(c)
+        scatter.append(idx)
+    # Encode in length-sorted order so each batch pads to roughly equal
+    # sequence lengths — one long chunk no longer drags a whole batch of
+    # short ones up to its padded length.
+    order = np.argsort([len(c) for c in unique_chunks])
+    with torch.inference_mode(), torch.autocast('cuda', dtype=AMP_DTYPE, enabled=device == 'cuda'):
+        vecs = model.encode(
+            [unique_chunks[j] for j in order],
+            batch_size=GPU_BATCH,
+            convert_to_tensor=True,
+            show_progress_bar=True,
+            normalize_embeddings=False,
+        )
+    # Undo the length sort, then fan the unique vectors back out to every
+    # occurrence so pooling still sees one row per original chunk
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    vecs = vecs[torch.as_tensor(inverse, device=vecs.device)]
+    vecs = vecs[torch.as_tensor(scatter, device=vecs.device)]
+    owners = torch.as_tensor(chunk_owner, device=vecs.device)
+    sums = torch.zeros(n_docs, vecs.shape[1], device=vecs.device, dtype=vecs.dtype)
+    sums.index_add_(0, owners, vecs)
+    counts = torch.zeros(n_docs, device=vecs.device, dtype=vecs.dtype)
+    counts.index_add_(0, owners, torch.ones(len(chunk_owner), device=vecs.device, dtype=vecs.dtype))
+    # clamp keeps the division defined; chunkless docs stay all-zero
+    means = sums / counts.clamp(min=1).unsqueeze(1)
+    # fp16 is the storage dtype: top-k retrieval quality is unchanged and
+    # the embedding column halves again vs fp32 (numpy has no bfloat16,
+    # so pooled bf16 goes through half here anyway)
+    return means.half().cpu().numpy()
 
 # ───────────────── parse_xml ─────────────────
-def parse_xml(s3_client, key):
+# Only these subtrees are ever read; iterparse dispatches on their end
+# events and everything else is freed as soon as it has been consumed,
+# so the multi-MB description tree never lives alongside the rest of
+# the document. Selectors are compiled once and applied relative to the
+# dispatched element; stdlib ET re-interprets the path string per call.
+_ITERPARSE_TAGS = ('abstract', 'description', 'claims', 'B200', 'B300', 'B400',
+                   'B510', 'B510EP', 'B520EP', 'B540', 'B700', 'B720', 'B860')
+_XP_IPC = etree.XPath("classification-ipcr/text/text()")
+_XP_CPC = etree.XPath("classifications-cpc/classification-cpc/text/text()")
+_XP_INT_APPL_NUM = etree.XPath("B861/dnum/anum/text()")
+_XP_APPLICANTS = etree.XPath("B710/B711/snm/text()")
+_XP_INVENTORS = etree.XPath("B721/snm/text()")
+_XP_INT_CLASS_MAIN = etree.XPath("B511/text()")
+_XP_INT_CLASS_SUBS = etree.XPath("B512/text()")
+_XP_DATE_PUBLICATION = etree.XPath("B405/date/text()")
+_XP_DATE_FILING = etree.XPath("B220/date/text()")
+_XP_PRIORITY_NUMBER = etree.XPath("B310/text()")
+_XP_PRIORITY_DATE = etree.XPath("B320/date/text()")
+# One compiled pass over the ordered-content tags, namespace-agnostic
+_XP_ORDERED = etree.XPath(
+    ".//*[local-name()='p' or local-name()='ul' or local-name()='li' or local-name()='heading']")
+
+def _first_text(results):
+    return results[0].strip() if results else ""
+
+def _join_texts(results):
+    return '; '.join(t.strip() for t in results if t.strip())
+
+def get_texts(parent, tags):
+    if parent is None: return ""
+    return ' '.join(
+        el.text.strip() for tag in tags for el in parent.findall(f'.//{tag}')
+        if el is not None and el.text
+    )
+
+def get_ordered_texts(elem):
+    if elem is None: return ""
+    texts = []
+    for child in _XP_ORDERED(elem):
+        text = ''.join(child.itertext()).strip()
+        if text:
+            texts.append(text)
+    return '\n'.join(texts)
+
+# ───────────────── Embedding cache ─────────────────
+# Content-addressed by "{key}@{etag}": re-runs over an unchanged week skip
+# download bodies, parsing, and GPU time entirely.
+_cache_lock = threading.Lock()
+_cache_conn = None
+
+def get_embed_cache():
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(EMBED_CACHE_DB, check_same_thread=False)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS embed_cache "
+                            "(cache_key TEXT PRIMARY KEY, doc TEXT, embedding BLOB)")
+        _cache_conn.commit()
+    return _cache_conn
+
+def cache_get(cache_key):
+    with _cache_lock:
+        row = get_embed_cache().execute(
+            "SELECT doc, embedding FROM embed_cache WHERE cache_key = ?",
+            (cache_key,)).fetchone()
+    if row is None:
+        return None
+    data = json.loads(row[0])
+    data["embedding"] = np.frombuffer(row[1], dtype=np.float16)
+    return data
+
+def cache_put(cache_key, data, vec):
+    doc = json.dumps({k: v for k, v in data.items() if k != "embedding"})
+    with _cache_lock:
+        get_embed_cache().execute(
+            "INSERT OR REPLACE INTO embed_cache (cache_key, doc, embedding) VALUES (?, ?, ?)",
+            (cache_key, doc, vec.tobytes()))
+        get_embed_cache().commit()
+
+async def fetch_all(keys, on_fetched, on_cached):
+    """I/O half: downloads every XML through one async S3 client with a
+    concurrency semaphore — a few hundred in-flight GETs instead of the
+    handful a thread pool sustains. The ETag from each response header is
+    checked against the embedding cache before the body is read, so
+    unchanged objects cost one round trip and no transfer; misses call
+    on_fetched(key, bytes, cache_key), hits call on_cached(row)."""
+    session = aioboto3.Session()
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    async with session.client('s3') as s3_async:
+        async def fetch(key):
+            async with semaphore:
+                try:
+                    response = await s3_async.get_object(Bucket=BUCKET, Key=key)
+                    cache_key = f"{key}@{response.get('ETag', '')}"
+                    cached = cache_get(cache_key)
+                    if cached is not None:
+                        on_cached(cached)
+                        return
+                    content = await response['Body'].read()
+                except Exception as e:
+                    print(f"❌ Error fetching {key}: {e}")
+                    return
+            on_fetched(key, content, cache_key)
+        await asyncio.gather(*(fetch(key) for key in keys))
+
+def parse_xml_bytes(content, key):
     try:
-        response = s3_client.get_object(Bucket=BUCKET, Key=key)
-        content = response['Body'].read()
-        root = ET.fromstring(content)
+        abstract_text = desc_text = claims_text = ""
+        ipc_classifications = cpc_classifications = ""
+        int_application_number = applicants = inventors = ""
+        int_classification = ""
+        date_publication = date_filing = ""
+        priority_number = priority_date = ""
+        titles = {'title_en': '', 'title_de': '', 'title_fr': ''}
+
+        context = etree.iterparse(io.BytesIO(content), events=('end',),
+                                  tag=_ITERPARSE_TAGS, huge_tree=True, recover=True)
+        for _event, elem in context:
+            tag = elem.tag
+            if tag == 'abstract':
+                if elem.get('id') == 'abst':
+                    abstract_text = get_texts(elem, ['p'])
+            elif tag == 'description':
+                if elem.get('id') == 'desc':
+                    desc_text = get_ordered_texts(elem)
+            elif tag == 'claims':
+                if elem.get('id') == 'claims01':
+                    claims_text = get_texts(elem, ['claim-text'])
+            elif tag == 'B510EP':
+                ipc_classifications = _join_texts(_XP_IPC(elem))
+            elif tag == 'B520EP':
+                cpc_classifications = _join_texts(_XP_CPC(elem))
+            elif tag == 'B860':
+                int_application_number = _first_text(_XP_INT_APPL_NUM(elem))
+            elif tag == 'B700':
+                applicants = _join_texts(_XP_APPLICANTS(elem))
+            elif tag == 'B720':
+                inventors = _join_texts(_XP_INVENTORS(elem))
+            elif tag == 'B540':
+                langs = elem.findall("B541")
+                texts = elem.findall("B542")
+                for lang_tag, title_tag in zip(langs, texts):
+                    lang = lang_tag.text.strip() if lang_tag.text else ""
+                    text = title_tag.text.strip() if title_tag.text else ""
+                    if lang.lower() == 'en': titles['title_en'] = text
+                    elif lang.lower() == 'de': titles['title_de'] = text
+                    elif lang.lower() == 'fr': titles['title_fr'] = text
+            elif tag == 'B510':
+                int_class_main = _first_text(_XP_INT_CLASS_MAIN(elem))
+                int_class_subs = [t.strip() for t in _XP_INT_CLASS_SUBS(elem) if t.strip()]
+                int_classification = '; '.join(filter(None, [int_class_main] + int_class_subs))
+            elif tag == 'B400':
+                date_publication = _first_text(_XP_DATE_PUBLICATION(elem))
+            elif tag == 'B200':
+                date_filing = _first_text(_XP_DATE_FILING(elem))
+            elif tag == 'B300':
+                priority_number = _first_text(_XP_PRIORITY_NUMBER(elem))
+                priority_date = _first_text(_XP_PRIORITY_DATE(elem))
+
+            # Free the consumed subtree; prune finished top-level siblings
+            # only when the parent is the root, so nested B-sections stay
+            # intact for any enclosing handler still to fire.
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None and parent.getparent() is None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+        root = context.root
         doc_id = root.attrib.get("id", "").strip()
         doc_number_str = root.attrib.get("doc-number", "").strip()
         if not doc_id or not doc_number_str or not doc_number_str.isdigit():
@@ -89,75 +319,9 @@ def parse_xml(s3_client, key):
             return None
         doc_number = int(doc_number_str)
 
-        def get_texts(parent, tags):
-            if parent is None: return ""
-            return ' '.join(
-                el.text.strip() for tag in tags for el in parent.findall(f'.//{tag}')
-                if el is not None and el.text
-            )
-
-        def get_ordered_texts(elem):
-            if elem is None: return ""
-            texts = []
-            for child in elem.iter():
-                tag = child.tag.split('}', 1)[-1]
-                if tag in ['p', 'ul', 'li', 'heading']:
-                    text = ''.join(child.itertext()).strip()
-                    if text:
-                        texts.append(text)
-            return '\n'.join(texts)
-
-        abstract_el = root.find(".//abstract[@id='abst']")
-        abstract_text = get_texts(abstract_el, ['p']) if abstract_el is not None else ""
-        desc_el = root.find(".//description[@id='desc']")
-        desc_text = get_ordered_texts(desc_el) if desc_el is not None else ""
-        claims_el = root.find(".//claims[@id='claims01']")
-        claims_text = get_texts(claims_el, ['claim-text']) if claims_el is not None else ""
-
-        ipc_elements = root.findall(".//B500/B510EP/classification-ipcr/text")
-        ipc_list = [el.text.strip() for el in ipc_elements if el is not None and el.text]
-        ipc_classifications = '; '.join(ipc_list)
-
-        cpc_elements = root.findall(".//B520EP/classifications-cpc/classification-cpc/text")
-        cpc_list = [el.text.strip() for el in cpc_elements if el is not None and el.text]
-        cpc_classifications = '; '.join(cpc_list)
-
-        int_appl_num_el = root.find(".//B860/B861/dnum/anum")
-        int_application_number = int_appl_num_el.text.strip() if int_appl_num_el is not None else ""
-
-        applicant_elements = root.findall(".//B700/B710/B711/snm")
-        applicants = '; '.join(el.text.strip() for el in applicant_elements if el is not None and el.text)
-
-        inventor_elements = root.findall(".//B720/B721/snm")
-        inventors = '; '.join(el.text.strip() for el in inventor_elements if el is not None and el.text)
-
-        titles = {'title_en': '', 'title_de': '', 'title_fr': ''}
-        b540 = root.find(".//B540")
-        if b540 is not None:
-            langs = b540.findall("B541")
-            texts = b540.findall("B542")
-            for lang_tag, title_tag in zip(langs, texts):
-                lang = lang_tag.text.strip() if lang_tag.text else ""
-                text = title_tag.text.strip() if title_tag.text else ""
-                if lang.lower() == 'en': titles['title_en'] = text
-                elif lang.lower() == 'de': titles['title_de'] = text
-                elif lang.lower() == 'fr': titles['title_fr'] = text
-
-        int_class_main = root.findtext(".//B510/B511", "").strip()
-        int_class_subs = [el.text.strip() for el in root.findall(".//B510/B512") if el.text]
-        int_classification = '; '.join(filter(None, [int_class_main] + int_class_subs))
-
-        date_pub_el = root.find(".//B400/B405/date")
-        date_publication = date_pub_el.text.strip() if date_pub_el is not None else ""
         year_publication = date_publication[:4]
-
-        date_filing_el = root.find(".//B200/B220/date")
-        date_filing = date_filing_el.text.strip() if date_filing_el is not None else ""
         year_filing = date_filing[:4]
 
-        priority_number = root.findtext(".//B300/B310", "").strip()
-        priority_date = root.findtext(".//B300/B320/date", "").strip()
-
         return {
             "doc_id": doc_id,
             **titles,
@@ -185,8 +349,11 @@ def parse_xml(s3_client, key):
         return None
 
 # ───────────────── Processing function ─────────────────
-def process_key(key):
-    data = parse_xml(s3, key)
+def parse_and_chunk(key, content):
+    """CPU-side half of the pipeline: parse one XML and chunk its text.
+    Runs in worker processes (forked after model load, so the tokenizer is
+    shared); embedding happens later in a single corpus-level GPU pass."""
+    data = parse_xml_bytes(content, key)
     if not data:
         return None
     full_text = "\n".join([
@@ -196,47 +363,282 @@ def process_key(key):
         f"Applicants: {data.get('applicants', '')}",
         f"Inventors: {data.get('inventors', '')}",
     ])
-    data["embedding"] = embed_document(full_text)
-    return data
+    # Feed the model natural text — e5 is trained on raw casing and full
+    # sentences, so stopword stripping/lemmatization only hurt quality.
+    chunks = [PASSAGE_PREFIX + c for c in chunk_text(full_text)]
+    return data, chunks
+
+# ───────────────── Listing ─────────────────
+def list_xml_keys(prefix):
+    """
+    Lists all XML keys under prefix with one paginator per sub-prefix
+    running in parallel, instead of a single paginator paying one round
+    trip per 1000-key page. A Delimiter probe finds subfolders to shard
+    on; files sitting directly under the prefix get their own delimited
+    paginator, so they are still found once the output parquet/ subfolder
+    (or any other) exists alongside them.
+    """
+    probe = s3.list_objects_v2(Bucket=BUCKET, Prefix=prefix, Delimiter='/')
+    shards = [p['Prefix'] for p in probe.get('CommonPrefixes', [])]
+
+    def list_shard(shard):
+        paginator = s3.get_paginator("list_objects_v2")
+        return [
+            obj['Key']
+            for page in paginator.paginate(Bucket=BUCKET, Prefix=shard)
+            for obj in page.get('Contents', [])
+        ]
+
+    def list_direct():
+        # Delimited pagination over the bare prefix returns only the files
+        # directly in it, across however many pages there are
+        paginator = s3.get_paginator("list_objects_v2")
+        return [
+            obj['Key']
+            for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix, Delimiter='/')
+            for obj in page.get('Contents', [])
+        ]
+
+    keys = []
+    with ThreadPoolExecutor(max_workers=LIST_WORKERS) as pool:
+        direct_future = pool.submit(list_direct)
+        for shard_keys in pool.map(list_shard, shards):
+            keys.extend(shard_keys)
+        keys.extend(direct_future.result())
+    return [k for k in keys if k.endswith(".xml") and not k.endswith("TOC.xml")]
+
+# Explicit output schema, matching the dict returned by parse_xml_bytes
+# minus year_publication (which becomes the hive partition directory) and
+# embedding (appended as FixedSizeList<float16> in build_table). Pinning
+# the types keeps every batch writable by the per-year ParquetWriter: with
+# inference, a 1000-row batch whose lang/country happened to be all None
+# came out null-typed and no longer matched the schema the writer was
+# opened with.
+_ROW_SCHEMA = pa.schema([
+    ('doc_id', pa.string()),
+    ('title_en', pa.string()),
+    ('title_de', pa.string()),
+    ('title_fr', pa.string()),
+    ('doc_number', pa.int64()),
+    ('lang', pa.string()),
+    ('country', pa.string()),
+    ('abstract', pa.string()),
+    ('description', pa.string()),
+    ('claims', pa.string()),
+    ('ipc_classifications', pa.string()),
+    ('cpc_classifications', pa.string()),
+    ('international_application_number', pa.string()),
+    ('applicants', pa.string()),
+    ('inventors', pa.string()),
+    ('int_classifications', pa.string()),
+    ('date_publication', pa.string()),
+    ('date_filing', pa.string()),
+    ('year_filing', pa.string()),
+    ('priority_number', pa.string()),
+    ('priority_date', pa.string()),
+])
 
 # ───────────────── Main ─────────────────
 def main():
     print(f"🔎 Listing XMLs under s3://{BUCKET}/{PREFIX}")
-    paginator = s3.get_paginator("list_objects_v2")
-    keys = [
-        obj['Key']
-        for page in paginator.paginate(Bucket=BUCKET, Prefix=PREFIX)
-        for obj in page.get('Contents', [])
-        if obj['Key'].endswith(".xml") and not obj['Key'].endswith("TOC.xml")
-    ]
+    keys = list_xml_keys(PREFIX)
     print(f"📂 Found {len(keys)} XML files")
 
-    records = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(process_key, key): key for key in keys}
-        for i, future in enumerate(as_completed(futures), 1):
-            key = futures[future]
-            try:
-                result = future.result()
-                if result:
-                    records.append(result)
-            except Exception as e:
-                print(f"❌ Error processing {key}: {e}")
-            if i % 100 == 0:
-                print(f"✅ Processed {i}/{len(keys)} files")
-
-    if not records:
+    # Three concurrent stages connected by bounded queues so parse, GPU
+    # embedding, and parquet writing overlap instead of running as serial
+    # phases holding the whole corpus in RAM:
+    #   A (producer thread): fetch threads + parse processes → results
+    #   B (main thread): buffer chunks, batched GPU embed → rows
+    #   C (writer thread): incremental ParquetWriter → S3 upload
+    results = queue.Queue(maxsize=RESULT_QUEUE_SIZE)
+    rows = queue.Queue(maxsize=RESULT_QUEUE_SIZE)
+    total_rows_written = 0
+
+    def producer():
+        # The event loop fetches bytes, processes parse/chunk them (the
+        # parse side is GIL-bound pure-Python/C work, so threads alone
+        # give no parallelism); the bounded queue applies backpressure
+        # when the GPU stage falls behind.
+        # Fork explicitly: parse_and_chunk reads the module-level tokenizer
+        # via copy-on-write. Under a spawn/forkserver default every worker
+        # would re-import the module and repeat the SentenceTransformer
+        # load, bf16 cast, torch.compile, and GPU warmup.
+        try:
+            with ProcessPoolExecutor(max_workers=PARSE_WORKERS,
+                                     mp_context=multiprocessing.get_context('fork')) as cpu_pool:
+                # Each parse future is drained by its done-callback the moment
+                # it finishes, so parsed chunks reach the GPU stage while the
+                # download is still in flight instead of piling up until
+                # fetch_all returns (which left the GPU idle for the whole
+                # download and held every raw XML body in memory). The
+                # semaphore caps outstanding submissions: acquiring in
+                # on_fetched blocks the fetch loop when parse falls behind.
+                inflight = threading.Semaphore(PARSE_WORKERS * 4)
+                processed = 0
+                processed_lock = threading.Lock()
+
+                def on_done(future, key, cache_key):
+                    nonlocal processed
+                    inflight.release()
+                    try:
+                        result = future.result()
+                        if result:
+                            data, chunks = result
+                            results.put((data, chunks, cache_key))
+                    except Exception as e:
+                        print(f"❌ Error processing {key}: {e}")
+                    with processed_lock:
+                        processed += 1
+                        if processed % 100 == 0:
+                            print(f"✅ Processed {processed}/{len(keys)} files")
+
+                def on_fetched(key, content, cache_key):
+                    inflight.acquire()
+                    future = cpu_pool.submit(parse_and_chunk, key, content)
+                    future.add_done_callback(
+                        lambda f, key=key, cache_key=cache_key: on_done(f, key, cache_key))
+
+                def on_cached(row):
+                    # Cache hits already carry their embedding — straight to
+                    # the writer, no parse or GPU pass.
+                    rows.put(row)
+
+                asyncio.run(fetch_all(keys, on_fetched, on_cached))
+                # Pool shutdown waits for the stragglers; their callbacks have
+                # pushed every result by the time the with-block exits.
+        finally:
+            # The embed stage blocks on results.get() until it sees the
+            # sentinel, so it must go in even when fetch or the pool died.
+            results.put(None)
+
+    def writer():
+        nonlocal total_rows_written
+        spill_dir = f"/tmp/{WEEK}_parquet"
+        # per-year hive partition state: year → open writer, rows in the
+        # current file, next file index, relative paths written so far
+        partitions = {}
+        batch = []
+
+        def build_table(rows_batch):
+            # Build the Arrow table directly — no pandas round trip. The
+            # embedding column is a FixedSizeList<float16>: fixed stride,
+            # no offsets, a quarter the bytes of the old
+            # list-of-Python-floats (which arrived as float64).
+            vecs = np.stack([row.pop("embedding") for row in rows_batch])
+            columns = {name: [row[name] for row in rows_batch]
+                       for name in _ROW_SCHEMA.names}
+            table = pa.Table.from_pydict(columns, schema=_ROW_SCHEMA)
+            return table.append_column("embedding", pa.FixedSizeListArray.from_arrays(
+                pa.array(vecs.reshape(-1), type=pa.float16()), TARGET_DIM))
+
+        def write_partition(year, year_rows):
+            state = partitions.setdefault(
+                year, {'writer': None, 'rows': 0, 'index': 0, 'paths': []})
+            if state['writer'] is not None and state['rows'] >= MAX_ROWS_PER_FILE:
+                state['writer'].close()
+                state['writer'] = None
+                state['rows'] = 0
+                state['index'] += 1
+            table = build_table(year_rows)
+            if state['writer'] is None:
+                rel_path = f"year_publication={year}/part-{state['index']:04d}.parquet"
+                local_path = os.path.join(spill_dir, rel_path)
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                state['writer'] = pq.ParquetWriter(local_path, table.schema,
+                                                   compression='zstd', use_dictionary=True)
+                state['paths'].append(rel_path)
+            state['writer'].write_table(table)
+            state['rows'] += table.num_rows
+
+        def flush(batch):
+            # The year_publication value moves into the hive directory
+            # name; readers get it back via partition discovery.
+            by_year = {}
+            for row in batch:
+                by_year.setdefault(row.get('year_publication') or 'unknown', []).append(row)
+            for year, year_rows in by_year.items():
+                write_partition(year, year_rows)
+
+        drained = False
+        try:
+            while True:
+                row = rows.get()
+                if row is None:
+                    drained = True
+                    break
+                batch.append(row)
+                total_rows_written += 1
+                if len(batch) >= ROWS_PER_GROUP:
+                    flush(batch)
+                    batch = []
+            if batch:
+                flush(batch)
+            for state in partitions.values():
+                if state['writer'] is not None:
+                    state['writer'].close()
+            if partitions:
+                print(f"⬆️ Uploading {total_rows_written} rows → s3://{BUCKET}/{OUTPUT_PREFIX}")
+                for state in partitions.values():
+                    for rel_path in state['paths']:
+                        s3.upload_file(os.path.join(spill_dir, rel_path),
+                                       BUCKET, OUTPUT_PREFIX + rel_path)
+                shutil.rmtree(spill_dir)
+        except Exception as e:
+            # Keep consuming until the sentinel so the embed stage's
+            # rows.put() never blocks on a dead writer and the join below
+            # returns; the error itself still gets reported.
+            print(f"❌ Writer failed: {e}")
+            while not drained and rows.get() is not None:
+                pass
+
+    producer_thread = threading.Thread(target=producer, daemon=True)
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    producer_thread.start()
+    writer_thread.start()
+
+    # Stage B runs on the main thread: accumulate whole documents until
+    # enough chunks are buffered for an efficient GPU pass, embed, and
+    # hand the finished rows to the writer. Docs never split across
+    # flushes, so embed_corpus can pool per-doc within each window.
+    window_docs, window_chunks, window_owner, window_keys = [], [], [], []
+
+    def flush_embed():
+        embeddings = embed_corpus(window_chunks, window_owner, len(window_docs))
+        for data, cache_key, vec in zip(window_docs, window_keys, embeddings):
+            data["embedding"] = vec
+            cache_put(cache_key, data, vec)
+            rows.put(data)
+        window_docs.clear()
+        window_chunks.clear()
+        window_owner.clear()
+        window_keys.clear()
+
+    try:
+        while True:
+            item = results.get()
+            if item is None:
+                break
+            data, chunks, cache_key = item
+            window_owner.extend([len(window_docs)] * len(chunks))
+            window_docs.append(data)
+            window_chunks.extend(chunks)
+            window_keys.append(cache_key)
+            if len(window_chunks) >= EMBED_FLUSH_CHUNKS:
+                flush_embed()
+        if window_docs:
+            flush_embed()
+    finally:
+        # The writer blocks on rows.get() until its sentinel — it must go
+        # in even when a GPU pass raises, or the join below never returns.
+        rows.put(None)
+
+    producer_thread.join()
+    writer_thread.join()
+
+    if total_rows_written == 0:
         print("⚠️ No parsed records found. Exiting.")
         return
-
-    df = pd.DataFrame(records)
-    print(f"✅ Parsed rows: {len(df)}; columns in parquet = parsed fields + 'embedding'")
-
-    buf = io.BytesIO()
-    df.to_parquet(buf, index=False, engine="pyarrow")
-    buf.seek(0)
-    s3.put_object(Bucket=BUCKET, Key=OUTPUT_KEY, Body=buf.getvalue())
-    print(f"📦 Saved with embeddings → s3://{BUCKET}/{OUTPUT_KEY}")
+    print(f"📦 Saved with embeddings → s3://{BUCKET}/{OUTPUT_PREFIX}")
 
 if __name__ == "__main__":
     main()
@@ -1,22 +1,17 @@
+import io
 import os
-import time
 import datetime
 import boto3 # Import boto3 for S3 interaction
-import shutil # For removing directories if needed
+import httpx # Direct HTTPS client for the USPTO bulk-data JSON API
 import zipfile # For handling zip files
 import re      # For regex in filename parsing and XML splitting
-import xml.etree.ElementTree as ET # For XML parsing
-import pandas as pd # For DataFrame and Parquet
+from lxml import etree as ET # libxml2-backed XML parsing
+import pyarrow as pa # Arrow tables built straight from the column lists
+import pyarrow.parquet as pq # Parquet writing without the pandas round trip
 import tempfile # For temporary directories
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, ElementNotInteractableException, StaleElementReferenceException
-from selenium.webdriver.common.keys import Keys # Import Keys for TAB
+import threading # Guards lazy creation of the shared parse pool
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError # For S3 specific errors
 
 
@@ -24,41 +19,37 @@ from botocore.exceptions import ClientError # For S3 specific errors
 BUCKET_NAME = "uspto.inventohub"
 # Ensure your AWS credentials are configured (e.g., via environment variables, ~/.aws/credentials, or IAM role)
 # Setting region explicitly, match your bucket's region
-s3 = boto3.client("s3", region_name='ap-south-1') 
-
-# --- Set your download directory ---
-# This directory will hold the ZIP files temporarily after Selenium downloads them.
-# They will be deleted after being processed and uploaded to S3.
-download_dir = os.path.abspath("./ptgr_downloads")
-os.makedirs(download_dir, exist_ok=True)
-
-# --- Chrome configuration ---
-chrome_options = Options()
-chrome_options.add_experimental_option("prefs", {
-    "download.default_directory": download_dir,
-    "download.prompt_for_download": False,
-    "directory_upgrade": True,
-    "safebrowsing.enabled": True
-})
-
-chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-chrome_options.add_argument("--disable-blink-features=AutomationControlled")  ## ANTI DETECTION MEASURE
-user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
-chrome_options.add_argument(f"user-agent={user_agent}")
-
-# Run in headless mode for server environments
-chrome_options.add_argument("--headless=new") # Use new headless mode
-chrome_options.add_argument('--no-sandbox')
-chrome_options.add_argument('--disable-dev-shm-usage')
-chrome_options.add_argument('--disable-gpu') # Needed for some headless environments
-chrome_options.add_argument("--window-size=1920,1080") # Set window size for headless
+s3 = boto3.client("s3", region_name='ap-south-1')
+
+# Multipart transfers with 16 concurrent 8 MB parts — single-stream S3
+# GET/PUT throughput plateaus well below what the link can carry.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=16,
+    use_threads=True,
+)
+# Background workers that upload finished zips and convert them to Parquet
+# while the main loop keeps downloading the next file.
+PIPELINE_WORKERS = 4
+# Records per Parquet row group; the accumulator flushes into the writer at
+# this size so peak memory stays O(row group) instead of O(zip)
+ROWS_PER_GROUP = 50_000
+
+# --- USPTO bulk-data JSON API ---
+# The JSON endpoint backing the portal's results table; hitting it directly
+# replaces the whole browser-automation stack (Chrome startup, anti-bot JS,
+# fixed sleeps) with one GET.
+PTGRXML_FILES_URL = "https://data.uspto.gov/api/bulkdata/products/ptgrxml/files"
+HTTP_TIMEOUT = httpx.Timeout(60.0, read=300.0)
+DOWNLOAD_CHUNK = 1024 * 1024
 
 # --- Function to get the latest USPTO patent grant date (Tuesday) ---
 def get_latest_uspto_patent_grant_date():
     """
     Calculates the date of the most recent Tuesday, as USPTO Patent Grant data
     (PTGRXML) is typically issued weekly on Tuesdays.
-    Returns date in MM-DD-YYYY format, matching website's expected input.
+    Returns date in MM-DD-YYYY format, matching the API's expected input.
     """
     today = datetime.date.today()
     # Monday=0, Tuesday=1, ..., Sunday=6
@@ -69,44 +60,52 @@ def get_latest_uspto_patent_grant_date():
     latest_tuesday = today - datetime.timedelta(days=days_to_subtract)
     return latest_tuesday.strftime("%m-%d-%Y")
 
-# --- Helper function to wait for a file download to complete ---
-def wait_for_download_completion(file_path, timeout=300):
+# --- Helper functions for the bulk-data API ---
+def list_ptgrxml_files(client, from_date, to_date):
     """
-    Waits for a file to appear and complete downloading by monitoring its size.
-    Returns True if download completes, False otherwise.
+    Lists the weekly PTGRXML zip files in the given date range via the JSON
+    API. Returns the raw file entries (fileName, fileUrl, ...).
     """
-    print(f"[INFO] Waiting for download to complete. Expected file: {file_path}")
-    start_time = time.time()
-    download_complete = False
-    initial_size = -1
-
-    while time.time() - start_time < timeout:
-        # Check for .crdownload or .tmp extension for ongoing downloads
-        if os.path.exists(file_path + ".crdownload") or os.path.exists(file_path + ".tmp"):
-            time.sleep(1) # Still downloading, wait
-            continue
-
-        if os.path.exists(file_path):
-            current_size = os.path.getsize(file_path)
-            if initial_size == -1: # First time we detect the file
-                initial_size = current_size
-                print(f"[INFO] File '{os.path.basename(file_path)}' detected. Current size: {current_size} bytes. Waiting for completion...")
-                time.sleep(5) # Give it some time to start downloading and show initial growth
-            elif current_size > initial_size: # File is actively growing
-                initial_size = current_size
-                time.sleep(1) # Check frequently
-            elif current_size == initial_size and current_size > 0: # Size hasn't changed and it's not 0, assume complete
-                print(f"[✓] Download complete: {os.path.basename(file_path)} (Final size: {current_size} bytes)")
-                download_complete = True
+    response = client.get(PTGRXML_FILES_URL, params={"from": from_date, "to": to_date})
+    response.raise_for_status()
+    return response.json().get("files", [])
+
+class ResponseReader(io.RawIOBase):
+    """
+    Read-only file view over a streaming httpx response, so upload_fileobj
+    can pull multipart parts straight off the wire.
+    """
+
+    def __init__(self, response):
+        self._chunks = response.iter_bytes(chunk_size=DOWNLOAD_CHUNK)
+        self._buf = b""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            out = self._buf + b"".join(self._chunks)
+            self._buf = b""
+            return out
+        while len(self._buf) < size:
+            try:
+                self._buf += next(self._chunks)
+            except StopIteration:
                 break
-        else: # File not yet created or detected
-            time.sleep(1)
-    
-    if not download_complete:
-        print(f"❌ Download failed or timed out for '{os.path.basename(file_path)}'. File not found or did not complete within timeout.")
-        if os.path.exists(file_path):
-            print(f"Partial download might exist at: {file_path}")
-    return download_complete
+        out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+def stream_zip_to_s3(client, file_url, s3_key):
+    """
+    Pipes one zip's HTTP download stream straight into a multipart S3
+    upload — the archive never touches local disk and there is nothing to
+    poll for completion.
+    """
+    with client.stream("GET", file_url) as response:
+        response.raise_for_status()
+        s3.upload_fileobj(ResponseReader(response), BUCKET_NAME, s3_key, Config=TRANSFER_CONFIG)
+    print(f"[✓] Streamed {os.path.basename(s3_key)} to s3://{BUCKET_NAME}/{s3_key}")
 
 # --- Helper function to check if a file exists in S3 ---
 def s3_file_exists(bucket, key):
@@ -121,103 +120,281 @@ def s3_file_exists(bucket, key):
             # Propagate other errors (like permissions)
             raise
 
-# --- Helper function to upload to S3 ---
-def upload_to_s3(local_path, bucket, s3_key):
-    """Uploads a single file to S3."""
-    print(f"⬆️ Uploading {os.path.basename(local_path)} to s3://{bucket}/{s3_key}")
-    try:
-        s3.upload_file(local_path, bucket, s3_key)
-        print(f"✅ Upload complete for {os.path.basename(local_path)}.")
-        return True
-    except ClientError as e:
-        print(f"❌ Error uploading {os.path.basename(local_path)} to S3: {e}")
-        return False
+def list_s3_keys(prefix):
+    """One LIST pass over a prefix; replaces a HEAD round trip per key."""
+    paginator = s3.get_paginator('list_objects_v2')
+    return {
+        obj["Key"]
+        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix)
+        for obj in page.get("Contents", [])
+    }
 
 # --- XML Extraction and Parquet Conversion Logic ---
-def split_patent_documents(xml_content):
+def _new_pull_parser():
     """
-    Splits a single XML file content into individual patent XML strings.
+    Pull parser for one standalone patent document. collect_ids=False skips
+    libxml2's per-document xml:id hash, and resolve_entities=False leaves
+    entity expansion off; both are pure overhead for a read-only scan.
     """
-    # This regex looks for the DOCTYPE and the root element, which is the start of a new patent document.
-    # It assumes each patent document is self-contained with its own XML declaration and DOCTYPE.
-    pattern = re.compile(
-        r"(<\?xml[^>]+>\s*<!DOCTYPE[^>]+>\s*<us-patent-[a-z-]+[^>]*>.*?</us-patent-[a-z-]+>)",
-        re.DOTALL
+    return ET.XMLPullParser(
+        events=('end',), recover=True, huge_tree=True,
+        collect_ids=False, resolve_entities=False,
     )
-    return pattern.findall(xml_content)
 
-def extract_data(xml_string):
+def _drain_parser(parser):
+    """Closes a pull parser and yields any patent elements it still holds."""
+    try:
+        parser.close()
+    except ET.XMLSyntaxError:
+        pass  # truncated/odd tail — keep whatever parsed cleanly
+    for _event, elem in parser.read_events():
+        if isinstance(elem.tag, str) and elem.tag.startswith('us-patent-'):
+            yield elem
+
+def iter_patent_elements(stream):
+    """
+    Streams each <us-patent-*> element out of a USPTO bulk XML file — a
+    concatenation of standalone documents, each opening with its own XML
+    declaration. A fresh pull parser starts at every declaration line, so
+    memory stays O(one patent) instead of the old whole-file string plus
+    a DOTALL regex scan over it. Callers must consume each element before
+    advancing the iterator; it is cleared afterwards.
+    """
+    parser = None
+    # iter(readline, ...) instead of plain iteration so any binary stream
+    # with a readline method (files, mmaps, ZipExtFile) works as a source
+    for line in iter(stream.readline, b''):
+        if line.lstrip().startswith(b'<?xml'):
+            if parser is not None:
+                yield from _drain_parser(parser)
+            parser = _new_pull_parser()
+        if parser is None:
+            parser = _new_pull_parser()
+        parser.feed(line)
+        for _event, elem in parser.read_events():
+            if isinstance(elem.tag, str) and elem.tag.startswith('us-patent-'):
+                yield elem
+                elem.clear()
+    if parser is not None:
+        yield from _drain_parser(parser)
+
+# Selectors compiled once at module scope — stdlib ET re-interpreted every
+# path string per call; these walk libxml2's compiled expressions and the
+# text() variants return strings without wrapping leaf Elements.
+_XP_TITLE = ET.XPath(".//invention-title/text()")
+_XP_CPC = ET.XPath(".//classification-cpc")
+_XP_CPC_VERSION = ET.XPath("cpc-version-indicator/date/text()")
+_XP_CPC_SECTION = ET.XPath("section/text()")
+_XP_CPC_CLASS = ET.XPath("class/text()")
+_XP_CPC_SUBCLASS = ET.XPath("subclass/text()")
+_XP_CPC_MAIN_GROUP = ET.XPath("main-group/text()")
+_XP_CPC_SUBGROUP = ET.XPath("subgroup/text()")
+_XP_ABSTRACT = ET.XPath(".//abstract")
+_XP_ABSTRACT_PS = ET.XPath(".//abstract//p")
+_XP_PUB_REF = ET.XPath(".//publication-reference/document-id")
+_XP_APP_REF = ET.XPath(".//application-reference/document-id")
+_XP_DOC_COUNTRY = ET.XPath("country/text()")
+_XP_DOC_NUMBER = ET.XPath("doc-number/text()")
+_XP_DOC_KIND = ET.XPath("kind/text()")
+_XP_DOC_DATE = ET.XPath("date/text()")
+_XP_ASSIGNEES = ET.XPath(".//assignee/addressbook")
+_XP_INVENTORS = ET.XPath(".//inventor/addressbook")
+_XP_ORGNAME = ET.XPath("orgname/text()")
+_XP_ADDR_CITY = ET.XPath("address/city/text()")
+_XP_ADDR_COUNTRY = ET.XPath("address/country/text()")
+_XP_LAST_NAME = ET.XPath("last-name/text()")
+_XP_FIRST_NAME = ET.XPath("first-name/text()")
+_XP_DESC_PS = ET.XPath(".//description//p")
+# Cheap pre-extraction peek at the dedupe key, so known records skip the
+# full extract_data walk entirely
+_XP_PEEK_DOC_NUMBER = ET.XPath(".//publication-reference/document-id/doc-number/text()")
+
+# Filename-date and whitespace patterns, compiled once at import instead of
+# per call (the whitespace one runs on every description)
+_DATE_RE = re.compile(r'ipg(\d{6}).*?\.zip', re.IGNORECASE)
+_WS_RE = re.compile(r'[ \t\n]+')
+
+def _first(results):
+    """First string from a text() XPath result, or None (findtext parity)."""
+    return results[0] if results else None
+
+# Output column order, shared by the accumulator and the final DataFrame
+_COLUMNS = (
+    "title", "classifications", "classification_versions", "abstract_text",
+    "pub_ref_country", "pub_ref_doc_number", "pub_ref_kind", "pub_ref_date",
+    "app_ref_country", "app_ref_doc_number", "app_ref_kind", "app_ref_date",
+    "assignees_orgnames", "assignees_cities", "assignees_countries",
+    "inventors_last_names", "inventors_first_names",
+    "inventors_cities", "inventors_countries",
+    "description_text",
+)
+
+# Columns holding one list per patent (CPC codes, assignees, inventors)
+_LIST_COLUMNS = frozenset((
+    "classifications", "classification_versions",
+    "assignees_orgnames", "assignees_cities", "assignees_countries",
+    "inventors_last_names", "inventors_first_names",
+    "inventors_cities", "inventors_countries",
+))
+
+# Explicit Arrow schema so table construction never has to infer types
+# from the (possibly None-filled) column lists
+_ARROW_SCHEMA = pa.schema([
+    (name, pa.list_(pa.string()) if name in _LIST_COLUMNS else pa.string())
+    for name in _COLUMNS
+])
+
+class Accumulator:
     """
-    Extracts relevant data points from a single patent XML string.
+    Column-oriented record store: one list per output column instead of one
+    dict per patent. Appending into lists skips the per-record dict key
+    hashing, and the DataFrame is built straight from the columns without
+    pandas re-inferring a schema over tens of thousands of dicts.
     """
-    root = ET.fromstring(xml_string)
-    output = {}
+    __slots__ = _COLUMNS
 
+    def __init__(self):
+        for name in _COLUMNS:
+            setattr(self, name, [])
+
+    def __len__(self):
+        return len(self.title)
+
+    def append(self, values):
+        """Appends one record given as a tuple in _COLUMNS order."""
+        for name, value in zip(_COLUMNS, values):
+            getattr(self, name).append(value)
+
+    def extend(self, other):
+        for name in _COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in _COLUMNS}
+
+def extract_data(root):
+    """
+    Extracts relevant data points from a single parsed patent element.
+    Returns one record as a tuple in _COLUMNS order — no per-record dict,
+    so there is no key hashing and the accumulator consumes it positionally.
+    """
     # Patent Title
-    output["title"] = root.findtext(".//invention-title")
+    title = _first(_XP_TITLE(root))
 
     # CPC Classifications
     classifications = []
     classification_versions = []
-    for classification in root.findall(".//classification-cpc"):
-        version = classification.findtext("cpc-version-indicator/date")
-        section = classification.findtext("section")
-        class_ = classification.findtext("class")
-        subclass = classification.findtext("subclass")
-        main_group = classification.findtext("main-group")
-        subgroup = classification.findtext("subgroup")
+    for classification in _XP_CPC(root):
+        version = _first(_XP_CPC_VERSION(classification))
+        section = _first(_XP_CPC_SECTION(classification))
+        class_ = _first(_XP_CPC_CLASS(classification))
+        subclass = _first(_XP_CPC_SUBCLASS(classification))
+        main_group = _first(_XP_CPC_MAIN_GROUP(classification))
+        subgroup = _first(_XP_CPC_SUBGROUP(classification))
         # Ensure all parts exist before formatting to avoid NoneType errors
         if all(v is not None for v in [section, class_, subclass, main_group, subgroup]):
             formatted_class = f"{section}{class_}{subclass} {main_group}/{subgroup}"
             classifications.append(formatted_class)
             classification_versions.append(version)
 
-    output["classifications"] = classifications
-    output["classification_versions"] = classification_versions
-
     # Abstract Text
-    abstract_element = root.find(".//abstract")
-    output["abstract_text"] = " ".join(p.text for p in abstract_element.findall(".//p") if p.text).strip() if abstract_element is not None else None
+    if _XP_ABSTRACT(root):
+        abstract_text = " ".join(
+            p.text for p in _XP_ABSTRACT_PS(root) if p.text).strip()
+    else:
+        abstract_text = None
 
     # Publication and Application References
-    for ref_type, prefix in [("publication-reference", "pub_ref"), ("application-reference", "app_ref")]:
-        doc_id = root.find(f".//{ref_type}/document-id")
-        if doc_id is not None:
-            output[f"{prefix}_country"] = doc_id.findtext("country")
-            output[f"{prefix}_doc_number"] = doc_id.findtext("doc-number")
-            output[f"{prefix}_kind"] = doc_id.findtext("kind")
-            output[f"{prefix}_date"] = doc_id.findtext("date")
+    def doc_id_fields(xp_ref):
+        doc_ids = xp_ref(root)
+        if not doc_ids:
+            return None, None, None, None
+        doc_id = doc_ids[0]
+        return (_first(_XP_DOC_COUNTRY(doc_id)), _first(_XP_DOC_NUMBER(doc_id)),
+                _first(_XP_DOC_KIND(doc_id)), _first(_XP_DOC_DATE(doc_id)))
+
+    pub_ref_country, pub_ref_doc_number, pub_ref_kind, pub_ref_date = doc_id_fields(_XP_PUB_REF)
+    app_ref_country, app_ref_doc_number, app_ref_kind, app_ref_date = doc_id_fields(_XP_APP_REF)
 
     # Assignees
-    output["assignees_orgnames"] = []
-    output["assignees_cities"] = []
-    output["assignees_countries"] = []
-    for ab in root.findall(".//assignee/addressbook"):
-        output["assignees_orgnames"].append(ab.findtext("orgname"))
-        addr = ab.find("address")
-        output["assignees_cities"].append(addr.findtext("city") if addr is not None else None)
-        output["assignees_countries"].append(addr.findtext("country") if addr is not None else None)
+    assignees_orgnames = []
+    assignees_cities = []
+    assignees_countries = []
+    for ab in _XP_ASSIGNEES(root):
+        assignees_orgnames.append(_first(_XP_ORGNAME(ab)))
+        assignees_cities.append(_first(_XP_ADDR_CITY(ab)))
+        assignees_countries.append(_first(_XP_ADDR_COUNTRY(ab)))
 
     # Inventors
-    output["inventors_last_names"] = []
-    output["inventors_first_names"] = []
-    output["inventors_cities"] = []
-    output["inventors_countries"] = []
-    for ab in root.findall(".//inventor/addressbook"):
-        output["inventors_last_names"].append(ab.findtext("last-name"))
-        output["inventors_first_names"].append(ab.findtext("first-name"))
-        addr = ab.find("address")
-        output["inventors_cities"].append(addr.findtext("city") if addr is not None else None)
-        output["inventors_countries"].append(addr.findtext("country") if addr is not None else None)
-
-    # Description Text
-    desc_text = []
-    for desc in root.findall(".//description//p"):
-        desc_text.append(" ".join(desc.itertext()))
-    # Clean up multiple spaces and newlines/tabs
-    output["description_text"] = re.sub(' +', ' ', " ".join(desc_text).replace("\n", " ").replace("\t", " ")).strip()
-
-    return output
+    inventors_last_names = []
+    inventors_first_names = []
+    inventors_cities = []
+    inventors_countries = []
+    for ab in _XP_INVENTORS(root):
+        inventors_last_names.append(_first(_XP_LAST_NAME(ab)))
+        inventors_first_names.append(_first(_XP_FIRST_NAME(ab)))
+        inventors_cities.append(_first(_XP_ADDR_CITY(ab)))
+        inventors_countries.append(_first(_XP_ADDR_COUNTRY(ab)))
+
+    # Description Text — tostring(method='text') concatenates a paragraph's
+    # text nodes in one C pass instead of feeding every fragment through a
+    # Python-level join (descriptions are the longest field by far)
+    desc_text = [ET.tostring(desc, method='text', encoding='unicode', with_tail=False)
+                 for desc in _XP_DESC_PS(root)]
+    # Collapse spaces/newlines/tabs in one pass
+    description_text = _WS_RE.sub(' ', " ".join(desc_text)).strip()
+
+    return (
+        title, classifications, classification_versions, abstract_text,
+        pub_ref_country, pub_ref_doc_number, pub_ref_kind, pub_ref_date,
+        app_ref_country, app_ref_doc_number, app_ref_kind, app_ref_date,
+        assignees_orgnames, assignees_cities, assignees_countries,
+        inventors_last_names, inventors_first_names,
+        inventors_cities, inventors_countries,
+        description_text,
+    )
+
+def parse_xml_file(zip_path, member_name, skip_doc_numbers=frozenset()):
+    """
+    Parses one XML member straight out of the zip into a column
+    accumulator — the member is decompressed incrementally as the parser pulls
+    lines, so the uncompressed XML never touches disk. Records whose
+    publication doc-number is in skip_doc_numbers, or repeats within the
+    member, are dropped on a cheap doc-number peek before the full
+    extract_data walk runs. Top-level so it can run as a
+    ProcessPoolExecutor worker; each worker opens its own handle on the zip.
+    """
+    acc = Accumulator()
+    seen = set()
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref, \
+         zip_ref.open(member_name, 'r') as raw:
+        stream = io.BufferedReader(raw, buffer_size=1 << 20)
+        for patent_elem in iter_patent_elements(stream):
+            try:
+                doc_number = _first(_XP_PEEK_DOC_NUMBER(patent_elem))
+                if doc_number is not None:
+                    if doc_number in skip_doc_numbers or doc_number in seen:
+                        continue
+                    seen.add(doc_number)
+                acc.append(extract_data(patent_elem))
+            except Exception as e:
+                print(f"[Error] Extracting patent data from a record in {os.path.basename(member_name)}: {e}")
+    return acc
+
+# One process pool shared by every conversion. Each pipeline thread used to
+# open its own ProcessPoolExecutor sized to os.cpu_count(), so with
+# PIPELINE_WORKERS conversions in flight the box ran up to
+# PIPELINE_WORKERS * cpu_count parse processes contending for the same
+# cores. Created lazily so importing the module never forks workers.
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def get_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+        return _parse_pool
 
 # --- MODIFIED: process_uspto_zip_to_parquet now accepts an optional local_zip_path_to_process ---
 def process_uspto_zip_to_parquet(s3_zip_key, local_zip_path_to_process=None):
@@ -239,7 +416,7 @@ def process_uspto_zip_to_parquet(s3_zip_key, local_zip_path_to_process=None):
 
     # Extract date_part for parquet filename (e.g., '240101' from 'ipg240101.zip')
     # This new pattern captures the 6 digits but allows for other characters before .zip
-    date_match = re.search(r'ipg(\d{6}).*?\.zip', zip_base, re.IGNORECASE)
+    date_match = _DATE_RE.search(zip_base)
     if not date_match:
         print(f"[Error] Could not extract date_part from filename: {zip_base}. Skipping Parquet conversion.")
         return False
@@ -249,14 +426,9 @@ def process_uspto_zip_to_parquet(s3_zip_key, local_zip_path_to_process=None):
     parquet_s3_key = f"{year_folder}/xmls/{date_part}.parquet"
 
     # Check if parquet already exists in S3 to avoid reprocessing
-    try:
-        s3.head_object(Bucket=BUCKET_NAME, Key=parquet_s3_key)
+    if s3_file_exists(BUCKET_NAME, parquet_s3_key):
         print(f"[✓] Skipping Parquet generation for {zip_base} → Already processed as {parquet_s3_key}")
         return True # Already processed
-    except ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            print(f"[Error] Checking S3 for existing Parquet {parquet_s3_key}: {e}")
-            return False # Other S3 error, stop processing this file
 
     # Use a temporary directory for all local operations (download, extract, create parquet)
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -270,333 +442,193 @@ def process_uspto_zip_to_parquet(s3_zip_key, local_zip_path_to_process=None):
             actual_zip_path = os.path.join(temp_dir, zip_base)
             try:
                 print(f"[INFO] Downloading {s3_zip_key} from S3 for processing...")
-                s3.download_file(BUCKET_NAME, s3_zip_key, actual_zip_path)
+                s3.download_file(BUCKET_NAME, s3_zip_key, actual_zip_path, Config=TRANSFER_CONFIG)
                 print(f"[INFO] Downloaded {zip_base} from S3.")
             except ClientError as e:
                 print(f"❌ Error downloading {s3_zip_key} from S3: {e}")
                 return False
 
 
-        extract_path = os.path.join(temp_dir, "extracted_xmls")
-        os.makedirs(extract_path, exist_ok=True)
-
+        # Only the member list is read here; the XMLs themselves stream out
+        # of the zip inside the workers, so nothing is extracted to disk.
         try:
             with zipfile.ZipFile(actual_zip_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_path)
-            print(f"[Extracted] ZIP: {zip_base} to {extract_path}")
+                xml_files = [info.filename for info in zip_ref.infolist()
+                             if info.filename.endswith('.xml')]
         except zipfile.BadZipFile:
             print(f"[Error] {zip_base} is a bad or corrupted zip file. Skipping processing.")
             return False
         except Exception as e:
-            print(f"[Error] Extracting {zip_base}: {e}")
+            print(f"[Error] Reading {zip_base}: {e}")
             return False
-
-        xml_files = [f for f in os.listdir(extract_path) if f.endswith('.xml')]
         if not xml_files:
             print(f"[!] No XML files found inside {zip_base}. Skipping Parquet creation.")
             return False
 
         print(f"[Info] Found {len(xml_files)} XML files inside {zip_base}")
 
-        consolidated_records = []
-        for xml_file in xml_files:
-            local_xml_file_path = os.path.join(extract_path, xml_file)
+        # Parsing is pure CPU, so the files fan out across a process pool
+        # (threads would serialize on the GIL); only the column accumulators
+        # cross back over the process boundary. Row groups are flushed into
+        # the writer as they fill, so peak memory is O(row group) of Python
+        # lists plus the compressed output, not every record in the zip.
+        parquet_buf = io.BytesIO()
+        writer = pq.ParquetWriter(parquet_buf, _ARROW_SCHEMA,
+                                  compression='zstd', compression_level=3)
+        seen_doc_numbers = set()
+        total_rows = 0
+        acc = Accumulator()
+
+        def flush_row_group(acc):
+            nonlocal total_rows
+            if len(acc):
+                writer.write_table(pa.Table.from_pydict(acc.to_dict(), schema=_ARROW_SCHEMA))
+                total_rows += len(acc)
+            return Accumulator()
+
+        # The shared pool stays open across conversions; concurrent calls
+        # interleave their files in it rather than stacking extra pools.
+        pool = get_parse_pool()
+        future_to_file = {
+            pool.submit(parse_xml_file, actual_zip_path, xml_file): xml_file
+            for xml_file in xml_files
+        }
+        for future in as_completed(future_to_file):
+            xml_file = future_to_file[future]
             try:
-                # Read raw data, try UTF-8 first, then ISO-8859-1
-                with open(local_xml_file_path, 'rb') as f:
-                    raw_data = f.read()
-                try:
-                    xml_content = raw_data.decode("utf-8")
-                except UnicodeDecodeError:
-                    xml_content = raw_data.decode("ISO-8859-1")
-
-                # Split into individual patent documents within the XML file
-                patents = split_patent_documents(xml_content)
-                print(f" └─ {xml_file}: {len(patents)} patent records found")
-
-                for patent_xml_string in patents:
-                    try:
-                        record = extract_data(patent_xml_string)
-                        consolidated_records.append(record)
-                    except ET.ParseError as pe:
-                        print(f"[Error] XML ParseError in {xml_file} for a patent record: {pe}")
-                    except Exception as e:
-                        print(f"[Error] Extracting patent data from a record in {xml_file}: {e}")
-
+                file_acc = future.result()
+                print(f" └─ {xml_file}: {len(file_acc)} patent records found")
+
+                # Running dedupe on 'pub_ref_doc_number' (always present,
+                # None when the reference is absent) — first occurrence
+                # wins, same semantics as the old drop_duplicates
+                keep = []
+                for idx, doc_number in enumerate(file_acc.pub_ref_doc_number):
+                    if doc_number not in seen_doc_numbers:
+                        seen_doc_numbers.add(doc_number)
+                        keep.append(idx)
+                if len(keep) != len(file_acc):
+                    for name in _COLUMNS:
+                        col = getattr(file_acc, name)
+                        setattr(file_acc, name, [col[i] for i in keep])
+
+                acc.extend(file_acc)
+                if len(acc) >= ROWS_PER_GROUP:
+                    acc = flush_row_group(acc)
             except Exception as e:
                 print(f"[Error] Reading or processing XML file {xml_file}: {e}")
 
-        if consolidated_records:
-            df = pd.DataFrame(consolidated_records)
-            # Use 'pub_ref_doc_number' for deduplication if it's consistently available and unique
-            if "pub_ref_doc_number" in df.columns:
-                df.drop_duplicates(subset=["pub_ref_doc_number"], inplace=True)
-                print(f"[Info] Deduplicated to {len(df)} unique records.")
-            else:
-                print("WARNING: 'pub_ref_doc_number' not found for deduplication. Skipping deduplication.")
-
-            parquet_output_path = os.path.join(temp_dir, f"{date_part}.parquet")
-            df.to_parquet(parquet_output_path, index=False)
-            
-            # Upload Parquet to S3
-            if upload_to_s3(parquet_output_path, BUCKET_NAME, parquet_s3_key):
-                print(f"[✓] Successfully processed and uploaded {len(df)} records from {zip_base} to {parquet_s3_key}.")
+        flush_row_group(acc)
+        writer.close()
+
+        if total_rows:
+            print(f"[Info] Deduplicated to {total_rows} unique records.")
+            parquet_buf.seek(0)
+            print(f"⬆️ Uploading {date_part}.parquet to s3://{BUCKET_NAME}/{parquet_s3_key}")
+            try:
+                s3.upload_fileobj(parquet_buf, BUCKET_NAME, parquet_s3_key, Config=TRANSFER_CONFIG)
+                print(f"[✓] Successfully processed and uploaded {total_rows} records from {zip_base} to {parquet_s3_key}.")
                 return True
-            else:
-                print(f"❌ Failed to upload Parquet file for {zip_base}.")
+            except ClientError as e:
+                print(f"❌ Failed to upload Parquet file for {zip_base}: {e}")
                 return False # Upload failed
         else:
             print(f"[!] No valid patent records were extracted from {zip_base}. No Parquet created.")
             return False
     # temp_dir and its contents are automatically cleaned up when exiting 'with' block
 
-# --- Function to set rows per page ---
-def set_rows_per_page(driver, wait, rows_per_page="75"):
-    """
-    Clicks the 'Rows per page' dropdown and selects the specified number of rows.
-    """
-    print(f"[INFO] Attempting to set 'Rows per page' to {rows_per_page}...")
-    try:
-        # 1. Click the dropdown to open it
-        rows_per_page_dropdown = wait.until(
-            EC.element_to_be_clickable((By.XPATH, "//span[@aria-label='Rows per page' and contains(@class, 'p-select-label')]"))
-        )
-        rows_per_page_dropdown.click()
-        print("[INFO] 'Rows per page' dropdown clicked.")
-
-        # 2. Wait for the options to appear and click the desired option
-        rows_per_page_option_xpath = f"//li[@role='option']/span[text()='{rows_per_page}']"
-        option_to_select = wait.until(
-            EC.element_to_be_clickable((By.XPATH, rows_per_page_option_xpath))
-        )
-        option_to_select.click()
-        print(f"[INFO] Selected '{rows_per_page}' rows per page.")
-        time.sleep(5) # Give time for the page to update/re-render the table with new rows
-
-        return True
-
-    except TimeoutException:
-        print(f"❌ Timeout trying to set 'Rows per page' to {rows_per_page}. Element not found or clickable.")
-        driver.save_screenshot(f"set_rows_per_page_timeout_error.png")
-        return False
-    except NoSuchElementException:
-        print(f"❌ 'Rows per page' dropdown or '{rows_per_page}' option not found.")
-        driver.save_screenshot(f"set_rows_per_page_not_found_error.png")
-        return False
-    except ElementNotInteractableException:
-        print(f"❌ 'Rows per page' dropdown or option not interactable.")
-        driver.save_screenshot(f"set_rows_per_page_not_interactable_error.png")
-        return False
-    except Exception as e:
-        print(f"❌ An unexpected error occurred while setting 'Rows per page': {e}")
-        driver.save_screenshot(f"set_rows_per_page_general_error.png")
-        return False
-
-
 # --- Main Automation Pipeline ---
 if __name__ == "__main__":
-    driver = None
-    wait = None
+    # Uploads and Parquet conversion run here in the background so the main
+    # loop can keep downloading the next file instead of stalling on S3.
+    pipeline = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS)
+    pipeline_futures = []
     try:
-        # Initialize Chrome browser
-        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-        wait = WebDriverWait(driver, 60) # Increased wait time for page elements
-
-        # Inject JavaScript to mask navigator.webdriver and other detection points.
-        # This needs to be done *before* navigating to the page.
-        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
-            "source": """
-                Object.defineProperty(navigator, 'webdriver', {
-                    get: () => undefined
-                });
-                window.navigator.chrome = { runtime: {} };
-                Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3, 4, 5] });
-                Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en'] });
-            """
-        })
-
         # --- Dynamically get the latest end date ---
         latest_date_str = get_latest_uspto_patent_grant_date()
         # The 'from' date defines the start of the data range. Set as needed.
-        # Using an earlier date to ensure multiple files are available for demonstration.
-        # For testing, ensure this range contains files you expect.
-        from_date_str = "01-01-2024" 
-
-        # --- URL Construction ---
-        base_ptgrxml_url = "https://data.uspto.gov/bulkdata/datasets/ptgrxml"
-
-        print(f"[INFO] Navigating to the USPTO PTGRXML dataset page: {base_ptgrxml_url}")
-        driver.get(base_ptgrxml_url)
-
-        print("[INFO] Waiting for initial page content to load (10 seconds)...")
-        time.sleep(10) # Give sufficient time for anti-bot mechanisms and page JS to execute
-
-        current_url = driver.current_url
-        if "uspto.gov/home" in current_url and current_url != base_ptgrxml_url:
-            print("❌ Redirection to USPTO home page detected immediately after initial navigation.")
-            print("This indicates strong bot detection. Consider running with headless=False for visual debugging.")
-            driver.save_screenshot("initial_redirect_error.png")
-            raise Exception("Bot detection suspected: Redirected to home page.")
-
-        print(f"[INFO] Page loaded: {current_url}")
-
-        # --- Step 1: Locate and set the 'Start Date' input field using JavaScript ---
-        print(f"[INFO] Setting 'Start Date' to: {from_date_str} using JavaScript.")
-        from_date_input = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@aria-labelledby='from']")))
-        driver.execute_script(f"arguments[0].value = '{from_date_str}';", from_date_input)
-        # Trigger a blur event to make the date picker acknowledge the change
-        driver.execute_script("arguments[0].dispatchEvent(new Event('blur'));", from_date_input)
-        # Also try sending TAB, just in case a native event is needed
-        from_date_input.send_keys(Keys.TAB)
-        time.sleep(1)
-
-        # --- Step 2: Locate and set the 'End Date' input field using JavaScript ---
-        print(f"[INFO] Setting 'End Date' to: {latest_date_str} using JavaScript.")
-        to_date_input = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@aria-labelledby='to']")))
-        driver.execute_script(f"arguments[0].value = '{latest_date_str}';", to_date_input)
-        # Trigger a blur event
-        driver.execute_script("arguments[0].dispatchEvent(new Event('blur'));", to_date_input)
-        # Also try sending TAB
-        to_date_input.send_keys(Keys.TAB)
-        time.sleep(1)
-
-        # --- Step 3: Click the "Filter" button ---
-        print("[INFO] Clicking the 'Filter' button...")
-        filter_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(.,'Filter')]")))
-        filter_button.click()
-        print("[INFO] 'Filter' button clicked. Waiting for results table to update (5 seconds)...")
-        time.sleep(5) # Give time for the page to process the filter and update the results table
-
-        # --- Set Rows per Page to 75 ---
-        set_rows_per_page(driver, wait, "75")
-        time.sleep(5) # Give extra time for page to settle after changing rows per page
-
-        print(f"\n[INFO] Processing the current page (after filter and rows per page setting)...")
-        # --- Find ALL download links in the updated results table ---
-        print("[INFO] Looking for all .zip download links in the current results table...")
-        
-        all_download_links = []
-        try:
-            # Wait for at least one download link to be present, indicating table loaded
-            all_download_links = wait.until(EC.presence_of_all_elements_located((By.XPATH, "//a[contains(text(), '.zip') and @href='#']")))
-            
-            if not all_download_links:
-                print("❌ No .zip download links found on this page. Ending script.")
+        from_date_str = "01-01-2024"
+
+        print(f"[INFO] Listing PTGRXML files from {from_date_str} to {latest_date_str} via the bulk-data API...")
+        with httpx.Client(http2=True, timeout=HTTP_TIMEOUT, follow_redirects=True) as client:
+            files = list_ptgrxml_files(client, from_date_str, latest_date_str)
+
+            if not files:
+                print("❌ No .zip files listed for the requested date range. Ending script.")
             else:
-                print(f"[INFO] Found {len(all_download_links)} .zip files to download and process on the current page.")
-
-                # Iterate and download each file on the current page
-                for i in range(len(all_download_links)):
-                    try:
-                        # Re-locate the current link to avoid StaleElementReferenceException
-                        current_page_links = wait.until(EC.presence_of_all_elements_located((By.XPATH, "//a[contains(text(), '.zip') and @href='#']")))
-                        link = current_page_links[i]
-                        filename = link.text.strip()
-                    except IndexError:
-                        print(f"WARNING: Link at index {i} no longer exists on the page. Moving to next available link.")
-                        continue 
-                    except StaleElementReferenceException:
-                        print(f"WARNING: Stale element reference for link at index {i}. Re-locating and retrying.")
-                        all_download_links = wait.until(EC.presence_of_all_elements_located((By.XPATH, "//a[contains(text(), '.zip') and @href='#']")))
-                        try:
-                            link = all_download_links[i]
-                            filename = link.text.strip()
-                        except IndexError: 
-                            print(f"WARNING: Still unable to access link at index {i} after re-location. Skipping.")
-                            continue
-
-                    if not filename.lower().endswith(".zip"):
-                        print(f"WARNING: Extracted filename '{filename}' does not end with .zip. Skipping.")
-                        continue 
-                    
-                    # --- Extract the year based on 'ipgYYMMDD.zip' format ---
-                    try:
-                        short_year = filename[3:5] 
-                        year = f"20{short_year}" 
-                        raw_s3_key = f"{year}/zipped/{filename}" 
-                    except IndexError:
-                        print(f"WARNING: Could not parse year from filename '{filename}'. Skipping this file.")
+                print(f"[INFO] Found {len(files)} files to download and process.")
+
+            # One LIST per year prefix up front instead of two HEAD round
+            # trips per candidate file inside the loop.
+            years = {
+                f"20{name[3:5]}"
+                for name in ((f.get("fileName") or "").strip() for f in files)
+                if name.lower().endswith(".zip") and len(name) >= 5
+            }
+            existing_zipped = set()
+            existing_parquets = set()
+            for year in sorted(years):
+                existing_zipped |= list_s3_keys(f"{year}/zipped/")
+                existing_parquets |= list_s3_keys(f"{year}/xmls/")
+
+            for i, file_info in enumerate(files):
+                filename = (file_info.get("fileName") or "").strip()
+                file_url = file_info.get("fileUrl") or file_info.get("url")
+
+                if not filename.lower().endswith(".zip"):
+                    continue # TOC/checksum entries etc.
+                if not file_url:
+                    print(f"WARNING: No download URL in the API entry for '{filename}'. Skipping.")
+                    continue
+
+                # --- Extract the year based on 'ipgYYMMDD.zip' format ---
+                try:
+                    short_year = filename[3:5]
+                    year = f"20{short_year}"
+                    raw_s3_key = f"{year}/zipped/{filename}"
+                except IndexError:
+                    print(f"WARNING: Could not parse year from filename '{filename}'. Skipping this file.")
+                    continue
+
+                # --- Skip re-download and processing of finished files ---
+                date_match = _DATE_RE.search(filename)
+                date_part = date_match.group(1) if date_match else None
+                parquet_s3_check_key = f"{year}/xmls/{date_part}.parquet" if date_part else None
+
+                if raw_s3_key in existing_zipped:
+                    if parquet_s3_check_key in existing_parquets:
+                        print(f"SKIPPING: Both Raw ZIP '{filename}' and Parquet already exist on S3. Moving to next file.")
                         continue
-
-                    # --- NEW LOGIC for skipping re-download and processing ---
-                    date_match = re.search(r'ipg(\d{6})\.zip', filename, re.IGNORECASE)
-                    date_part = date_match.group(1) if date_match else None
-                    parquet_s3_check_key = f"{year}/xmls/{date_part}.parquet" if date_part else None
-
-                    if raw_s3_key and s3_file_exists(BUCKET_NAME, raw_s3_key):
-                        if parquet_s3_check_key and s3_file_exists(BUCKET_NAME, parquet_s3_check_key):
-                            print(f"SKIPPING: Both Raw ZIP '{filename}' and Parquet already exist on S3. Moving to next file.")
-                            continue 
-                        else:
-                            print(f"INFO: Raw ZIP '{filename}' exists on S3, but Parquet does not. Attempting to process existing raw ZIP from S3.")
-                            process_uspto_zip_to_parquet(raw_s3_key) 
-                            continue 
-
-                    # Proceed with download if not skipped
-                    print(f"[Clicking] Download link {i+1}/{len(all_download_links)} for: {filename}")
-                    try:
-                        link.click() # Attempt standard click
-                    except Exception as e: # Catch any exception during click
-                        print(f"❌ Failed to click {filename}: {e}. Retrying with JavaScript click.")
-                        driver.execute_script("arguments[0].click();", link) # Fallback to JavaScript click
-                        print(f"[INFO] Successfully clicked {filename} using JavaScript.")
-                    
-                    local_download_path = os.path.join(download_dir, filename)
-                    
-                    # Wait for download to complete
-                    download_succeeded = wait_for_download_completion(local_download_path) 
-
-                    if download_succeeded:
-                        # --- Step 5: Upload Raw ZIP to S3 ---
-                        upload_succeeded = upload_to_s3(local_download_path, BUCKET_NAME, raw_s3_key)
-                        
-                        if upload_succeeded:
-                            # --- Step 6: Process the locally downloaded and newly uploaded ZIP into Parquet ---
-                            process_uspto_zip_to_parquet(raw_s3_key, local_zip_path_to_process=local_download_path)
-
-                            # Clean up local raw ZIP file after successful upload and processing
-                            try:
-                                os.remove(local_download_path)
-                                print(f"🧹 Local raw ZIP file deleted: {local_download_path}")
-                            except OSError as e:
-                                print(f"❌ Error deleting local raw ZIP file {local_download_path}: {e}")
-                        else:
-                            print(f"Skipping Parquet processing for {filename} due to failed S3 upload of raw ZIP.")
                     else:
-                        print(f"Skipping S3 upload and Parquet processing for {filename} due to failed download.")
-                    
-                    time.sleep(2) # Short pause between downloads/uploads to prevent overwhelming the browser/server
-
-        except TimeoutException:
-            print("❌ Could not find any .zip download links on this page within timeout. Ending script.")
-        
-    except TimeoutException as e:
-        print(f"A timeout occurred: {e}")
-        print("This often means an element was not found or the page didn't load in time.")
-        if driver: driver.save_screenshot("timeout_error_screenshot.png")
-        print("Screenshot saved as timeout_error_screenshot.png for debugging.")
-    except NoSuchElementException as e:
-        print(f"An element was not found: {e}")
-        print("The XPath or selector might be incorrect, or the page structure has changed.")
-        if driver: driver.save_screenshot("element_not_found_error.png")
-        print("Screenshot saved as element_not_found_error.png for debugging.")
+                        print(f"INFO: Raw ZIP '{filename}' exists on S3, but Parquet does not. Attempting to process existing raw ZIP from S3.")
+                        pipeline_futures.append(pipeline.submit(process_uspto_zip_to_parquet, raw_s3_key))
+                        continue
+
+                # Proceed with download if not skipped — the stream goes
+                # straight into the raw-zip S3 key, no local copy.
+                print(f"[Downloading] {i+1}/{len(files)}: {filename} → s3://{BUCKET_NAME}/{raw_s3_key}")
+                try:
+                    stream_zip_to_s3(client, file_url, raw_s3_key)
+                except (httpx.HTTPError, ClientError) as e:
+                    print(f"❌ Streaming {filename} to S3 failed: {e}")
+                    continue
+
+                # Parquet conversion re-opens the zip from S3 in the
+                # background while the next download streams up.
+                pipeline_futures.append(pipeline.submit(process_uspto_zip_to_parquet, raw_s3_key))
+
+    except httpx.HTTPError as e:
+        print(f"❌ Bulk-data API request failed: {e}")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-        # Ensure driver is initialized before trying to save screenshot
-        if driver:
-            driver.save_screenshot("general_error_screenshot.png")
-            print("Screenshot saved as general_error_screenshot.png for debugging.")
-        else:
-            print("Driver was not initialized, cannot save screenshot.")
 
     finally:
-        if driver:
-            print("[INFO] Quitting browser.")
-            driver.quit()
-        # Clean up the temporary download directory if it's empty or you want to ensure it's removed
-        if os.path.exists(download_dir) and not os.listdir(download_dir):
+        # Let in-flight uploads/conversions finish before exiting
+        for future in pipeline_futures:
             try:
-                os.rmdir(download_dir)
-                print(f"🧹 Cleaned up empty download directory: {download_dir}")
-            except OSError as e:
-                print(f"❌ Error removing empty download directory {download_dir}: {e}")
\ No newline at end of file
+                future.result()
+            except Exception as e:
+                print(f"❌ Background upload/convert task failed: {e}")
+        pipeline.shutdown()
+        if _parse_pool is not None:
+            _parse_pool.shutdown()